@@ -3,7 +3,7 @@
 
 ## IMPORTANT: FOLDER STRUCTURE ##
 Below mentioned folder structure must be followed for getting the results from this script:
-01. Script must be placed into a folder known as main folder
+01. Script must be placed into a folder known as main folder, together with RecordLinkageCommon.py (functions shared by the scripts) and RecordLinkageScore.py (record based score)
 02. Source files (3 lists) must be placed into the Source folder under main folder
 03. a folder named as IntermediateFiles must be created under main folder with below mentioned sub-folders
     A. Source
@@ -32,177 +32,160 @@ This script performs determistics data matching between customer list and negati
 import os
 import pandas as pd
 import numpy as np
+import re
 from datetime import datetime
 import unicodedata
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+from RecordLinkageCommon import readCSV, IntermediateFiles, MatchedFiles, matchedIndex, keyHash, sameKeys, probeIndex, mergeOrder, fileFingerprint, loadWatchList, saveWatchList, recordHashes, changedRecords, saveCustomerIndex, loadCustomerIndex, loadState, ruleFingerprint, unchangedCustomers
+# Module of the record based score of the matches (shared with 03_RecordLinkageDDMScore.py), only imported with the score option of DDM
+scoreModule = "RecordLinkageScore"
 
+# Column types of the source files (DOB is read as a date)
+sourceTypes = {"FIRST_NAME": object, "LAST_NAME": object, "STREET": object, "HNR": object, "HNRADD": object, "ZIP": object, "CITY": object}
 
-def extractSource(dir, files):
+
+def extractSource(dir, files, memoryMap=False):
     '''
     Function to extract Data from files in a specific format
     '''
-    t = {"FIRST_NAME": object, "LAST_NAME": object, "DOB": object, "STREET": object, "HNR": object, "HNRADD": object, "ZIP": object, "CITY": object}
     filename = dir + files
-    df = pd.read_csv(filename, index_col="ID", na_values="0000-00-00", parse_dates=[3], dtype=t)
+    df = readCSV(filename, sourceTypes, dates=["DOB"], naValues=["0000-00-00"], memoryMap=memoryMap)
     return df
 
 
-def caseConvertion(df):
-    '''
-    Function to convert string values present into columns to lowercase letters
-    '''
-    df = df.applymap(lambda s:s.lower() if type(s) == str else s)
-    return df
+# Missing DOB and other missing values of every list are replaced by these values before DDM
+missingValues = {"CUST": ('1900-00-00', '-99999'), "NEG": ('1800-00-00', '-88888'), "POS": ('1700-00-00', '-77777')}
 
+# Version of the preprocessing, must be increased whenever dataPreprocessing changes its output so that the watch-list indexes are rebuilt
+preprocessingVersion = 1
 
-def stripList(df):
-    '''
-    Function to trim the string values present into columns
-    '''
-    df = df.applymap(lambda s:s.strip() if type(s) == str else s)
-    return df
+# Translation tables used by the string normalizer, built once per run
+specChars = ["!", '"', "#", "%", "&", "'", "(", ")", "*", "+", ",", "-", ".", "/", ":", ";", "<", "=", ">", "?", "@", "[", "\\", "]", "^", "_", "`", "{", "|", "}", "~", "–"]
+specCharTable = str.maketrans({char: " " for char in specChars})
+umlautTable = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+titles = ["ms ", "mr ", "mrs ", "miss ", "master ", "professor ", "dr ", "herr ", "frau ", "prof "]
+titleCols = ["FIRST_NAME", "LAST_NAME"]
+# Columns which are preprocessed together (CITY depends on ZIP, HNRNEW is formed from HNR and HNRADD)
+dependentCols = [["ZIP", "CITY"], ["HNR", "HNRADD"]]
+# Address rules used by the address parser, compiled once per run and applied in the mentioned order
+cityPatterns = [(re.compile(pattern), repl) for pattern, repl in [('mainz a r', 'mainz'), ('frankfurt a m', 'frankfrut am main'), ('frankfurt am', 'frankfrut am main'), ('frankfurt a main', 'frankfrut am main'), ('frankfurt m', 'frankfrut a main')]]
+zipCityCorrections = {('frankfurt', '1'): 'frankfurt oder', ('frankfurt', '6'): 'frankfurt am main'}
+hnrPatterns = [re.compile(r'([\d]+\s[\d]+\s[\w]\s[\d]+)'), re.compile(r'([\d]+\s[\w])'), re.compile(r'([\d]+[\w])'), re.compile(r'([\d]+)')]
+streetPatterns = [(re.compile(pattern), 'strasse') for pattern in [' str', ' strsse', ' srasse', 'str$', 'strsse$', 'srasse$']]
 
 
-def removeSpecialChar(s):
+def normalizeString(s, removeTitles=False):
     '''
-    Function to replace special symbols present with a space
+    Function to normalize a single string value in one pass:
+    lowercase, trim, replace special symbols with a single space, remove titles (names only), replace umlauts and accents
     '''
-    spec_chars = ["!", '"', "#", "%", "&", "'", "(", ")", "*", "+", ",", "-", ".", "/", ":", ";", "<", "=", ">", "?", "@", "[", "\\", "]", "^", "_", "`", "{", "|", "}", "~", "–"]
-    for char in spec_chars:
-        s = s.replace(char, " ")
-        s = " ".join(s.split())
+    s = " ".join(s.lower().translate(specCharTable).split())
+    if removeTitles:
+        for title in titles:
+            s = s.replace(title, "").strip()
+    if not s.isascii():
+        s = s.translate(umlautTable)
+        s = unicodedata.normalize('NFKD', s).encode('ascii', 'ignore').decode('utf-8', 'ignore')
     return s
 
 
-def removeSpecial(df):
+def normalizeStrings(df):
     '''
-    Function to replace special characters from all the values present into different columns
+    Function to normalize all the string values of the dataframe with a single pass per column
     '''
-    df = df.applymap(lambda s:removeSpecialChar(s) if type(s) == str else s)
+    for col in df.columns:
+        if df[col].dtype == object:
+            removeTitles = col in titleCols
+            # Built as object column, so that a column without any string value (e.g. of a single record) stays a text column
+            df[col] = pd.Series([normalizeString(s, removeTitles) if type(s) == str else s for s in df[col]], index=df.index, dtype=object)
     return df
 
 
-def removeTitleName(s):
-    '''
-    Function to remove titles and honorifics from a series
-    '''
-    titles = ["ms ", "mr ", "mrs ", "miss ", "master ", "professor ", "dr ", "herr ", "frau ", "prof "]
-    for title in titles:
-        s = s.str.replace(title, "").str.strip()
-    return s
-
-
-def removeTitle(df):
+def formatZip(df):
     '''
-    Function to remove titles and honorifics from first name and last name
+    Function to standardize ZIP to a five characters format by appending leading zeroes.
     '''
-    df["FIRST_NAME"] = removeTitleName(df["FIRST_NAME"])
-    df["LAST_NAME"] = removeTitleName(df["LAST_NAME"])
+    df['ZIP'] = df['ZIP'].str.zfill(5)
     return df
 
 
-def replaceUmlaut(df):
+def correctCity(city, zipCode):
     '''
-    Function to replace umlauts (ä --> ae, ö --> oe, ü --> ue, ß --> ss)
+    Function to correct common spelling mistakes in a city name, using the first digit of the ZIP where the city name is ambiguous
     '''
-    df = df.applymap(lambda s:s.replace('ä','ae') if type(s) == str else s)
-    df = df.applymap(lambda s:s.replace('ö','oe') if type(s) == str else s)
-    df = df.applymap(lambda s:s.replace('ü','ue') if type(s) == str else s)
-    df = df.applymap(lambda s:s.replace('ß','ss') if type(s) == str else s)
-    return df
+    if type(city) != str:
+        return city
+    for pattern, repl in cityPatterns:
+        city = pattern.sub(repl, city)
+    if type(zipCode) == str:
+        city = zipCityCorrections.get((city, zipCode[:1]), city)
+    return city
 
 
-def removeAccentedChars(s):
+def parseStreet(street):
     '''
-    Function to replace special characters like accents to ASCII characters from a series 
+    Function to extract HNR from a street name if it contains any number and standardise the remaining street name (' str', ' strsse', ' srasse', 'str$', 'strsse$', 'srasse$' --> 'strasse')
     '''
-    s = unicodedata.normalize('NFKD', s).encode('ascii', 'ignore').decode('utf-8', 'ignore')
-    return s
+    if type(street) != str:
+        return street, np.nan
+    hnr = np.nan
+    for pattern in hnrPatterns[1:]:
+        match = pattern.search(street)
+        if match:
+            hnr = match.group(1).replace(' ', '')
+            break
+    for pattern in hnrPatterns:
+        street = pattern.sub('', street).strip()
+    for pattern, repl in streetPatterns:
+        street = pattern.sub(repl, street)
+    return street, hnr
 
 
-def removeAccented(df):
+def mapDistinct(func, *cols):
     '''
-    Function to replace special characters like accents to ASCII characters from the dataframe
+    Function to call a function once per distinct value (or combination of values) of the columns and return the results for all the rows
     '''
-    df = df.applymap(lambda s:removeAccentedChars(s) if type(s) == str else s)
-    return df
+    results = {}
+    for key in zip(*cols):
+        if key not in results:
+            results[key] = func(*key)
+    return [results[key] for key in zip(*cols)]
 
 
-def formatZip(df):
+def formatAddress(df):
     '''
-    Function to standardize ZIP to a five characters format by appending leading zeroes.
+    Function to standardize the address with a single pass per distinct value:
+    01. Correct common spelling mistakes in CITY
+    02. Extract HNR from STREET if it contains any number
+    03. Standardise the street name
     '''
-    df['ZIP'] = df['ZIP'].str.zfill(5)
+    df['CITY'] = pd.Series(mapDistinct(correctCity, df['CITY'], df['ZIP']), index=df.index, dtype=object)
+    streets = mapDistinct(parseStreet, df['STREET'])
+    df['STREET'] = pd.Series([street for street, hnr in streets], index=df.index, dtype=object)
+    df['HNRNEW'] = pd.Series([hnr for street, hnr in streets], index=df.index, dtype=object)
     return df
 
 
-def formatCity(df):
+def joinHnr(hnr, hnradd):
     '''
-    Function to correct common spelling mistakes in CITY
+    Function to combine a HNR and HNRADD without blanks (and without 'nan' of the missing values) into HNRNEW, missing if the result is empty
     '''
-    df['CITY'] = df['CITY'].str.replace('mainz a r', 'mainz')
-    df['CITY'] = df['CITY'].str.replace('frankfurt a m', 'frankfrut am main')
-    df['CITY'] = df['CITY'].str.replace('frankfurt am', 'frankfrut am main')
-    df['CITY'] = df['CITY'].str.replace('frankfurt a main', 'frankfrut am main')
-    df['CITY'] = df['CITY'].str.replace('frankfurt m', 'frankfrut a main')
-    df.loc[(df['CITY'] == 'frankfurt') & (df['ZIP'].str.startswith('1')), 'CITY'] = 'frankfurt oder'
-    df.loc[(df['CITY'] == 'frankfurt') & (df['ZIP'].str.startswith('6')), 'CITY'] = 'frankfurt am main'
-    return df
-
-
-def extractHNR(df):
-    '''
-    Function to extract HNR from STREET if it contains any number
-    '''
-    pattern1 = r'([\d]+)'
-    pattern2 = r'([\d]+[\w])'
-    pattern3 = r'([\d]+\s[\w])'
-    pattern4 = r'([\d]+\s[\d]+\s[\w]\s[\d]+)'
-    df["PAT3"] = df["STREET"].str.extract(pattern3).replace(' ', '')
-    df["PAT2"] = df["STREET"].str.extract(pattern2).replace(' ', '')
-    df["PAT1"] = df["STREET"].str.extract(pattern1).replace(' ', '')
-    df['HNRNEW'] = df['PAT3'].fillna(df["PAT2"].fillna(df["PAT1"]))
-    df['HNRNEW'] = df['HNRNEW'].str.replace(' ', '')
-    df["STREET"] = df["STREET"].str.replace(pattern4, '').str.strip()
-    df["STREET"] = df["STREET"].str.replace(pattern3, '').str.strip()
-    df["STREET"] = df["STREET"].str.replace(pattern2, '').str.strip()
-    df["STREET"] = df["STREET"].str.replace(pattern1, '').str.strip()
-    df = df.drop(columns=['PAT3'], axis = 1)
-    df = df.drop(columns=['PAT2'], axis = 1)
-    df = df.drop(columns=['PAT1'], axis = 1)
-    return df
+    hnrNew = (str(hnr).replace(' ', '').replace('nan', '').strip() + str(hnradd).replace(' ', '').replace('nan', '').strip()).strip()
+    return hnrNew if hnrNew != '' else np.nan
 
 
 def joinColumns(df):
     '''
-    Function to combine HNR and HNRADD to form a new column as HNRNEW and dropping the HNR and HNRADD columns from the dataframe
+    Function to combine HNR and HNRADD to form a new column as HNRNEW (single pass per distinct combination) and dropping the HNR and HNRADD columns from the dataframe
     '''
-    df["HNR"] = df["HNR"].astype(str)
-    df["HNRADD"] = df["HNRADD"].astype(str)
-    df["HNR"] = df["HNR"].str.replace(' ', '')
-    df["HNR"] = df["HNR"].str.replace('nan', '')
-    df["HNRADD"] = df["HNRADD"].str.replace(' ', '')
-    df["HNRADD"] = df["HNRADD"].str.replace('nan', '')
-    df["HNRNEW"] = df['HNR'].str.strip().fillna('') + df['HNRADD'].str.strip().fillna('')
-    df["HNRNEW"] = df["HNRNEW"].str.strip().replace(r'^\s*$', np.nan, regex=True)
+    df["HNRNEW"] = pd.Series(mapDistinct(joinHnr, df["HNR"], df["HNRADD"]), index=df.index, dtype=object)
     df = df.drop(columns=['HNR'], axis = 1)
     df = df.drop(columns=['HNRADD'], axis = 1)
     return df
 
 
-def formatStreet(df):
-    '''
-    Function to standardise street name (' str', ' strsse', ' srasse', 'str$', 'strsse$', 'srasse$' --> 'strasse')
-    '''
-    df['STREET'] = df['STREET'].str.replace(' str','strasse')
-    df['STREET'] = df['STREET'].str.replace(' strsse','strasse')
-    df['STREET'] = df['STREET'].str.replace(' srasse','strasse')
-    df['STREET'] = df['STREET'].str.replace('str$','strasse')
-    df['STREET'] = df['STREET'].str.replace('strsse$','strasse')
-    df['STREET'] = df['STREET'].str.replace('srasse$','strasse')
-    return df
-
-
-def dataPreprocessing(df):
+def dataPreprocessing(df, distinct=False):
     '''
     Function to perfrom data preprocessing and cleaning on customer list as per below mentioned order:
     01. Convert case to lowercase
@@ -211,26 +194,24 @@ def dataPreprocessing(df):
     04. Remove titles and honorifics from the name
     05. Replace german umlaut to english equivalents
     06. Replace special characters with ASCII characters
+        (steps 01 to 06 are performed in a single pass per column by normalizeStrings)
     07. Standardized the Zip
     08. Standardized the city name
     09. Extract HNR from STREET name
     10. Formation of HNRNEW
     11. Standardized the Street name
+        (steps 08, 09 and 11 are performed in a single pass per distinct value by formatAddress)
+    If distinct is True, the steps are performed only on the distinct values of the columns (see distinctPreprocessing)
     '''
-    df = caseConvertion(df)
-    df = stripList(df)
-    df = removeSpecial(df)
-    df = removeTitle(df)
-    df = replaceUmlaut(df)
-    df = removeAccented(df)
+    if distinct:
+        return distinctPreprocessing(df, dataPreprocessing)
+    df = normalizeStrings(df)
     df = formatZip(df)
-    df = formatCity(df)
-    df = extractHNR(df)
+    df = formatAddress(df)
     df = joinColumns(df)
-    df = formatStreet(df)
     return df
 
-def dataPreprocessing1(df):
+def dataPreprocessing1(df, distinct=False):
     '''
     Function to perfrom data preprocessing and cleaning on positive and negative lists as per below mentioned order:
     01. Convert case to lowercase
@@ -239,131 +220,207 @@ def dataPreprocessing1(df):
     04. Remove titles and honorifics from the name
     05. Replace german umlaut to english equivalents
     06. Replace special characters with ASCII characters
+        (steps 01 to 06 are performed in a single pass per column by normalizeStrings)
     07. Standardized the Zip
     08. Standardized the city name
     09. Extract HNR from STREET name
     10. Formation of NEWHNR
     11. Standardized the Street name
+        (steps 08, 09 and 11 are performed in a single pass per distinct value by formatAddress)
     12. Drop duplicate rows
+    If distinct is True, the steps 01 to 11 are performed only on the distinct values of the columns (see distinctPreprocessing)
     '''
-    df = caseConvertion(df)
-    df = stripList(df)
-    df = removeSpecial(df)
-    df = removeTitle(df)
-    df = replaceUmlaut(df)
-    df = removeAccented(df)
-    df = formatZip(df)
-    df = formatCity(df)
-    df = extractHNR(df)
-    df = joinColumns(df)
-    df = formatStreet(df)
+    df = dataPreprocessing(df, distinct)
     df.drop_duplicates(inplace=True)
     return df
 
 
-def IntermediateFiles(dir, file, df):
+def preprocessList(df, workers=1, distinct=False):
     '''
-    Function to create intermediate files post a specific operation like Data Preprocessing with index values
+    Function to perform dataPreprocessing1 on a negative or positive list, in a process pool if workers > 1
     '''
-    originalFiles = ["00_List_Customer_Monitoring.csv", "01a_List_Negative.csv", "01b_List_Positive.csv"]
-    if file in originalFiles:
-        file = file
-    else:
-        file = datetime.now().strftime("%Y%m%d") + "_" + file
-    filename = dir + file
-    df.to_csv(filename)
+    if workers > 1:
+        df, = parallelPreprocessing([df], workers, distinct)
+        df.drop_duplicates(inplace=True)
+        return df
+    return dataPreprocessing1(df, distinct)
 
 
-def MatchedFiles(dir, file, df):
+def distinctPreprocessing(df, preprocess):
     '''
-    Function to create intermediate files post a specific operation like Data Preprocessing without index values
+    Function to perform a row based preprocessing only on the distinct values of each column (or group of dependent columns) and map the results back to all the rows
     '''
-    originalFiles = ["00_List_Customer_Monitoring.csv", "01a_List_Negative.csv", "01b_List_Positive.csv"]
-    if file in originalFiles:
-        file = file
-    else:
-        file = datetime.now().strftime("%Y%m%d") + "_" + file
-    filename = dir + file
-    df.to_csv(filename, index=False)
+    groups = [group for group in dependentCols if all(col in df.columns for col in group)]
+    groupedCols = [col for group in groups for col in group]
+    groups = groups + [[col] for col in df.columns if col not in groupedCols]
+    codes = {}
+    vocab = []
+    for group in groups:
+        values = df[group].reset_index(drop=True)
+        uniques = values.drop_duplicates().reset_index(drop=True)
+        # merge treats NaN as a regular key, so every row gets the position of its distinct value
+        codes[group[0]] = values.merge(uniques.reset_index(), how="left", on=group)["index"].to_numpy()
+        vocab.append(uniques)
+    # Groups are independent of each other, so their distinct values are placed side by side in one frame
+    vocab = pd.concat(vocab, axis=1)[df.columns]
+    vocab = preprocess(vocab)
+    groupOf = {col: group[0] for group in groups for col in group}
+    groupOf["HNRNEW"] = groupOf.get("HNR", groupOf.get("STREET"))
+    df = pd.DataFrame({col: vocab[col].take(codes[groupOf[col]]).to_numpy() for col in vocab.columns}, index=df.index)
+    return df
 
 
-def matchedIndex(nmatch, pmatch, rule):
+def parallelPreprocessing(dfs, workers=None, distinct=False, chunkSize=50000):
     '''
-    Function to append customers matched with negative list to the customers matched with positive list
+    Function to perform dataPreprocessing on several dataframes at once by splitting them into chunks, preprocessing the chunks in a process pool and reassembling them in the original order
+    (dropping duplicate rows is not row based and must be done on the reassembled dataframes)
     '''
-    match = nmatch.append(pmatch, ignore_index=True, sort=False)
-    match = match[["ID_CUST", "ID_NEG", "ID_POS", "MATCH_CRITERIA", "MATCH_SCORE"]]
-    match.sort_values(by=["ID_CUST"], inplace=True)
-    match = match.reset_index()
-    match = match.drop("index", axis = 1)
-    return match
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for df in dfs:
+            chunks = [df.iloc[start:start + chunkSize] for start in range(0, max(len(df), 1), chunkSize)]
+            futures.append([executor.submit(dataPreprocessing, chunk, distinct) for chunk in chunks])
+        dfs = [pd.concat([future.result() for future in chunkFutures]) for chunkFutures in futures]
+    return dfs
 
 
-def colMatchDDMPOS(cust, pos, condition, i):
+def ddmIndex(df, cols):
     '''
-    Function to match customer with the positive list based on a condition
+    Function to compute a 64-bit hash of every key column used by the DDM rules once per record
     '''
-    print("Start of Rule" + str(i) + ": [" + ', '.join(condition[:-1]) + "]")
-    pos_match = pd.merge(cust, pos, how="inner", on=condition[:-1], suffixes=["_CUST", "_POS"])
-    matchCriteria = "DDM RULE" + str(i) + ": " + ', '.join(condition[:-1])
-    pos_match["MATCH_CRITERIA"] = matchCriteria
-    pos_match["MATCH_SCORE"] = float(condition[-1])
-    matched_index = pos_match[["ID_CUST", "ID_POS", "MATCH_CRITERIA", "MATCH_SCORE"]]
-    matched_index.sort_values(by=["ID_CUST"], inplace=True)
-    matched_index = matched_index.reset_index()
-    matched_index = matched_index.drop("index", axis = 1)
-    cust = cust[~cust["ID"].isin(matched_index["ID_CUST"])]
-    print("End of Rule" + str(i) +": [" + ', '.join(condition[:-1]) + "]")
-    return matched_index, cust
+    index = pd.DataFrame(index=df.index)
+    for col in cols:
+        # Only the distinct values are hashed, as objects so that a DOB gets the same hash in datetime and in mixed (date and sentinel) columns
+        codes, uniques = pd.factorize(df[col].astype(object).to_numpy())
+        # Missing values (code -1) get the hash 0 appended at the end
+        index[col] = np.append(pd.util.hash_array(uniques, categorize=False), np.uint64(0))[codes]
+    return index
 
 
-def colMatchDDMNEG(cust, neg, condition, i):
+def hashJoin(leftHash, rightHash):
     '''
-    Function to match customer with the negative list based on a condition
+    Function to join two arrays of key hashes and return the positions of the matching pairs in the same order as an inner pd.merge
+    (keys in the order of their first appearance in left, then left position, then right position)
     '''
-    print("Start of Rule" + str(i) + ": [" + ', '.join(condition[:-1]) + "]")
-    neg_match = pd.merge(cust, neg, how="inner", on=condition[:-1], suffixes=["_CUST", "_NEG"])
-    matchCriteria = "DDM RULE " + str(i) + ": " + ', '.join(condition[:-1])
-    neg_match["MATCH_CRITERIA"] = matchCriteria
-    neg_match["MATCH_SCORE"] = float(condition[-1])
-    matched_index = neg_match[["ID_CUST", "ID_NEG", "MATCH_CRITERIA", "MATCH_SCORE"]]
-    matched_index.sort_values(by=["ID_CUST"], inplace=True)
-    matched_index = matched_index.reset_index()
-    matched_index = matched_index.drop("index", axis = 1)
-    cust = cust[~cust["ID"].isin(matched_index["ID_CUST"])]
-    print("End of Rule" + str(i) +": [" + ', '.join(condition[:-1]) + "]")
-    return matched_index, cust
+    rightSorter = np.argsort(rightHash, kind="stable")
+    sortedRight = rightHash[rightSorter]
+    start = np.searchsorted(sortedRight, leftHash, side="left")
+    counts = np.searchsorted(sortedRight, leftHash, side="right") - start
+    leftPos = np.repeat(np.arange(len(leftHash)), counts)
+    offsets = np.arange(len(leftPos)) - np.repeat(np.cumsum(counts) - counts, counts)
+    rightPos = rightSorter[np.repeat(start, counts) + offsets]
+    # Pairs are already ordered by left and right position, a stable sort brings the keys in the order of pd.merge
+    keyOrder = pd.factorize(leftHash)[0]
+    order = np.argsort(keyOrder[leftPos], kind="stable")
+    return leftPos[order], rightPos[order]
 
 
-def DDM(cust_df, neg_df, pos_df):
+def priorityMatch(cust, lst, conditions, custIndex, lstIndex):
     '''
-    Function to iteratively perform DDM for all the defined rules
+    Function to match the customers with a list for all the DDM rules using the key hashes of ddmIndex, without copying the dataframes.
+    A customer is matched only by the first rule (in order of priority) with a hit, the pairs of a rule are in the order of an inner pd.merge of the customers not matched by the previous rules with the list.
+    Returns the positions of the matched customers and list records for every rule and the first matched rule of every customer (0 if none)
+    '''
+    custHash = custIndex.reindex(cust.index)
+    lstHash = lstIndex.reindex(lst.index)
+    firstRule = np.zeros(len(cust), dtype=int)
+    matches = []
+    for i, condition in enumerate(conditions, 1):
+        cols = condition[:-1]
+        alive = np.flatnonzero(firstRule == 0)
+        custPos, lstPos = hashJoin(keyHash(custHash, cols)[alive], keyHash(lstHash, cols))
+        custPos = alive[custPos]
+        keep = sameKeys(cust, lst, cols, custPos, lstPos)
+        custPos, lstPos = custPos[keep], lstPos[keep]
+        firstRule[custPos] = i
+        matches.append((custPos, lstPos))
+    return matches, firstRule
+
+
+def matchedFrame(custIDs, listIDs, listCol, matchCriteria, score, scores=None):
+    '''
+    Function to create the matched index of a rule (ID_CUST, ID_POS or ID_NEG, MATCH_CRITERIA and MATCH_SCORE) sorted on ID_CUST
+    With scores (scoreMatches of RecordLinkageScore.py and the scoring frames of the customers and the list) the record based score of every match is added as NEW_SCORE
+    '''
+    matched_index = pd.DataFrame({"ID_CUST": custIDs, listCol: listIDs})
+    matched_index["MATCH_CRITERIA"] = matchCriteria
+    matched_index["MATCH_SCORE"] = float(score)
+    if scores is not None:
+        scoreMatches, custScores, listScores = scores
+        matched_index["NEW_SCORE"] = scoreMatches(custIDs, listIDs, custScores, listScores)
+    matched_index = matched_index.sort_values(by=["ID_CUST"]).reset_index(drop=True)
+    return matched_index
+
+
+def ddmStream(cust, lst, conditions, custIndex, lstIndex, listName, rulePrefix, intFileDir, fileFormat="csv", scores=None):
+    '''
+    Function to perform DDM of the customers with one list (POS or NEG) for all the rules and to write the matched files of every rule (with NEW_SCORE, if scores are given, see matchedFrame).
+    The streams of the positive and the negative list are independent of each other and can run concurrently
+    '''
+    matches, firstRule = priorityMatch(cust, lst, conditions, custIndex, lstIndex)
+    custFile = r"00_List_Customer_Monitoring.csv"
+    idxs = []
+    for i, condition in enumerate(conditions, 1):
+        print("Start of " + listName + " Rule" + str(i) + ": [" + ', '.join(condition[:-1]) + "]")
+        FileName = "DDM_" + listName + "_Rule" + str(i) + ".csv"
+        custFilePostMatch = "DDM_" + listName + "_Rule" + str(i) + "_" + custFile
+        custPos, lstPos = matches[i - 1]
+        idx = matchedFrame(cust["ID"].to_numpy()[custPos], lst["ID"].to_numpy()[lstPos], "ID_" + listName, rulePrefix + str(i) + ": " + ', '.join(condition[:-1]), condition[-1], scores)
+        MatchedFiles(intFileDir, FileName, idx, fileFormat)
+        # Customers which are not matched by this rule or any of the previous rules
+        MatchedFiles(intFileDir, custFilePostMatch, cust[(firstRule == 0) | (firstRule > i)], fileFormat)
+        idxs.append(idx)
+    return idxs
+
+
+def ddmList(lst, listName):
+    '''
+    Function to prepare a negative or positive list for DDM, the missing values are replaced and first and last name are swapped into FN and LN
+    '''
+    dobValue, naValue = missingValues[listName]
+    lst["DOB"] = lst["DOB"].fillna(dobValue)
+    lst = lst.fillna(naValue)
+    lst['FN'] = lst['LAST_NAME']
+    lst['LN'] = lst['FIRST_NAME']
+    lst = lst.reset_index()
+    return lst
+
+
+def ddmCustomers(cust):
+    '''
+    Function to prepare the customer list for DDM, the missing values are replaced and first and last name are copied into FN and LN
+    '''
+    dobValue, naValue = missingValues["CUST"]
+    cust = cust.copy()
+    cust["DOB"] = cust["DOB"].fillna(dobValue)
+    cust = cust.fillna(naValue)
+    cust['FN'] = cust['FIRST_NAME']
+    cust['LN'] = cust['LAST_NAME']
+    cust = cust.reset_index()
+    return cust
+
+
+def watchList(srcFolder, file, listName, indexDir, workers=1, distinct=False):
+    '''
+    Function to get a preprocessed negative or positive list with the DDM key hashes of all its columns (after ddmList).
+    Both are read from the watch-list index and only rebuilt when the source file or the preprocessing changed
+    '''
+    fingerprint = fileFingerprint(srcFolder + file, preprocessingVersion)
+    watched = loadWatchList(indexDir, file, fingerprint)
+    if watched is not None:
+        print("Loaded from the watch-list index")
+        return watched
+    df = preprocessList(extractSource(srcFolder, file), workers, distinct)
+    lst = ddmList(df.copy(), listName)
+    index = ddmIndex(lst, lst.columns)
+    saveWatchList(indexDir, file, fingerprint, df, index)
+    return df, index
+
+
+def ddmConditions():
+    '''
+    Function to get the DDM rules in order of priority, every rule is a list of the key columns followed by the rule based matching score
     '''
-    print("Start DDM")
-    # Replace 0000-00-00 with 1900-00-00 in customer list to avoid invalid matches 
-    cust_df["DOB"] = cust_df["DOB"].fillna('1900-00-00')
-    cust_df = cust_df.fillna('-99999')
-    # Replace 0000-00-00 with 1800-00-00 in negative list to avoid invalid matches
-    neg_df["DOB"] = neg_df["DOB"].fillna('1800-00-00')
-    neg_df = neg_df.fillna('-88888')
-    # Replace 0000-00-00 with 1700-00-00 in negative list to avoid invalid matches
-    pos_df["DOB"] = pos_df["DOB"].fillna('1700-00-00')
-    pos_df = pos_df.fillna('-77777')
-    cust_pos_df = cust_df.copy()
-    cust_neg_df = cust_df.copy()
-    cust_pos_df['FN'] = cust_pos_df['FIRST_NAME']
-    cust_pos_df['LN'] = cust_pos_df['LAST_NAME']
-    cust_neg_df['FN'] = cust_neg_df['FIRST_NAME']
-    cust_neg_df['LN'] = cust_neg_df['LAST_NAME']
-    neg_df['FN'] = neg_df['LAST_NAME']
-    neg_df['LN'] = neg_df['FIRST_NAME']
-    pos_df['FN'] = pos_df['LAST_NAME']
-    pos_df['LN'] = pos_df['FIRST_NAME']
-    cust_df = cust_df.reset_index()
-    neg_df = neg_df.reset_index()
-    pos_df = pos_df.reset_index()
-    cust_pos_df = cust_pos_df.reset_index()
-    cust_neg_df = cust_neg_df.reset_index()
     # Rules or conditions to perform DDM along with rule based matching score
     condition1 = ['FIRST_NAME', 'LAST_NAME', 'DOB', 'ZIP', 'CITY', 'STREET', 'HNRNEW', 100]
     condition2 = ['FIRST_NAME', 'LAST_NAME', 'DOB', 'ZIP', 'STREET', 'HNRNEW', 99.4]
@@ -381,25 +438,133 @@ def DDM(cust_df, neg_df, pos_df):
     condition14 = ['DOB', 'ZIP', 'CITY', 'STREET', 'HNRNEW', 78]
     condition15 = ['FIRST_NAME', 'DOB', 'ZIP', 76]
     matchConditions = [condition1, condition2, condition3, condition4, condition5, condition6, condition7, condition8, condition9, condition10, condition11, condition12, condition13, condition14, condition15]
+    return matchConditions
+
+
+def customerIndex(cust_df, conditions):
+    '''
+    Function to create the customer index of the reverse mode, the customers prepared by ddmCustomers and for every DDM rule the sorted key hashes of the customers with their positions
+    '''
+    cust = ddmCustomers(cust_df)
+    keyCols = list(dict.fromkeys(col for condition in conditions for col in condition[:-1]))
+    custIndex = ddmIndex(cust, keyCols)
+    hashes = np.empty((len(conditions), len(cust)), dtype=np.uint64)
+    positions = np.empty((len(conditions), len(cust)), dtype=np.int64)
+    for r, condition in enumerate(conditions):
+        h = keyHash(custIndex, condition[:-1])
+        positions[r] = np.argsort(h, kind="stable")
+        hashes[r] = h[positions[r]]
+    return cust, {"hashes": hashes, "positions": positions}
+
+
+def reverseMatch(cust, lst, conditions, hashes, positions, lstIndex):
+    '''
+    Function to match a few list records against the customer index for all the DDM rules in order of priority.
+    Returns the positions of the matched customers and list records for every rule, the same as priorityMatch of all the customers with these list records
+    '''
+    matched = np.zeros(len(cust), dtype=bool)
+    matches = []
+    for r, condition in enumerate(conditions):
+        cols = condition[:-1]
+        lstHash = keyHash(lstIndex, cols)
+        custPos, lstPos = probeIndex(hashes[r], positions[r], lstHash)
+        keep = ~matched[custPos]
+        custPos, lstPos = custPos[keep], lstPos[keep]
+        keep = sameKeys(cust, lst, cols, custPos, lstPos)
+        custPos, lstPos = mergeOrder(lstHash[lstPos[keep]], custPos[keep], lstPos[keep])
+        matched[custPos] = True
+        matches.append((custPos, lstPos))
+    return matches
+
+
+def reverseScreening(cwd, fileFormat="csv", workers=1, distinct=False):
+    '''
+    Function to match only the records of the negative and positive list which are new or changed since the customers of the customer index were screened against them.
+    The customers are neither loaded nor preprocessed, the matches are written to DDM_REVERSE.csv
+    '''
+    srcFolder = cwd + r"\\Source\\"
+    indexDir = cwd + r"\\IntermediateFiles\\Preprocessed\\"
+    intFileDir = cwd + r"\\IntermediateFiles\\DDM\\"
+    customers = loadCustomerIndex(intFileDir + "CI_DDM", ["hashes", "positions"])
+    if customers is None:
+        raise FileNotFoundError("No customer index in " + intFileDir + ", run the script once with reverseIndex and without the reverse mode")
+    cust, (hashes, positions), screened = customers
+    matchConditions = ddmConditions()
+    idx = {}
+    # Criteria of the positive list have no blank between RULE and the rule number
+    for file, listName, rulePrefix in [(r"01a_List_Negative.csv", "NEG", "DDM RULE "), (r"01b_List_Positive.csv", "POS", "DDM RULE")]:
+        print(file)
+        df, index = watchList(srcFolder, file, listName, indexDir, workers, distinct)
+        listHashes = recordHashes(df)
+        changed = changedRecords(listHashes, screened[listName])
+        print(str(len(changed)) + " new or changed records")
+        lst = ddmList(df, listName).iloc[changed].reset_index(drop=True)
+        matches = reverseMatch(cust, lst, matchConditions, hashes, positions, index.iloc[changed].reset_index(drop=True))
+        idx[listName] = [matchedFrame(cust["ID"].to_numpy()[custPos], lst["ID"].to_numpy()[lstPos], "ID_" + listName, rulePrefix + str(i) + ": " + ', '.join(condition[:-1]), condition[-1]) for i, (condition, (custPos, lstPos)) in enumerate(zip(matchConditions, matches), 1)]
+        IntermediateFiles(intFileDir, file, df, fileFormat)
+        screened[listName] = listHashes
+    # The customers are now screened against this version of the lists, the next reverse run only matches the records changed after it
+    pd.to_pickle(screened, intFileDir + "CI_DDM_lists.pkl")
+    matched_idx = [matchedIndex(idx["NEG"][i], idx["POS"][i], matchCondition) for i, matchCondition in enumerate(matchConditions)]
+    matched_idx = pd.concat(matched_idx, ignore_index=True, sort=False)
+    matched_idx = matched_idx.sort_values(by=["ID_CUST"], kind="stable").reset_index(drop=True)
+    MatchedFiles(intFileDir, "DDM_REVERSE.csv", matched_idx, fileFormat)
+    return matched_idx
+
+
+def DDM(cust_df, neg_df, pos_df, fileFormat="csv", workers=1, negIndex=None, posIndex=None, unchanged=None, previousMatches=None, score=False):
+    '''
+    Function to perform DDM for all the defined rules in order of priority
+    (with workers > 1 the positive and the negative list are matched concurrently in a process pool, with the same result)
+    negIndex and posIndex are the DDM key hashes of the lists from the watch-list index, they are computed if not given
+    In delta mode only the customers which are not in unchanged are matched, the matches of the unchanged customers are taken from previousMatches
+    With score the record based score of every match (same as 03_RecordLinkageDDMScore.py) is computed from the preprocessed records in memory and added as NEW_SCORE
+    '''
+    print("Start DDM")
+    # The scoring frames are taken before the missing values are replaced
+    ddmScore = importlib.import_module(scoreModule) if score else None
+    scores = {listName: ddmScore.scoringFrame(df) for listName, df in [("CUST", cust_df), ("NEG", neg_df), ("POS", pos_df)]} if score else None
+    # Replace 0000-00-00 with 1900-00-00 in customer list to avoid invalid matches 
+    cust_df["DOB"] = cust_df["DOB"].fillna(missingValues["CUST"][0])
+    cust_df = cust_df.fillna(missingValues["CUST"][1])
+    # Replace 0000-00-00 with 1800-00-00 in negative list and with 1700-00-00 in positive list to avoid invalid matches
+    neg_df = ddmList(neg_df, "NEG")
+    pos_df = ddmList(pos_df, "POS")
+    if unchanged is None:
+        cust_pos_df = ddmCustomers(cust_df)
+    else:
+        cust_pos_df = ddmCustomers(cust_df[~cust_df.index.isin(unchanged)])
+    cust_neg_df = cust_pos_df.copy()
+    cust_df = cust_df.reset_index()
+    matchConditions = ddmConditions()
+    # Hash of every key column used by the rules, computed once per record
+    keyCols = list(dict.fromkeys(col for matchCondition in matchConditions for col in matchCondition[:-1]))
+    custIndex = ddmIndex(cust_pos_df, keyCols)
+    if negIndex is None:
+        negIndex = ddmIndex(neg_df, keyCols)
+    if posIndex is None:
+        posIndex = ddmIndex(pos_df, keyCols)
     cwd = os.getcwd()
     intFileDir = cwd + r"\\IntermediateFiles\\DDM\\"
-    i = 1
-    custFile = r"00_List_Customer_Monitoring.csv"
-    matched_idx = pd.DataFrame()
-    for matchCondition in matchConditions:
-        FileNamePOS = "DDM_POS_Rule" + str(i) + ".csv"
-        FileNameNEG = "DDM_NEG_Rule" + str(i) + ".csv"
-        custFilePOSPostMatch = "DDM_POS_Rule" + str(i) + "_" + custFile
-        custFileNEGPostMatch = "DDM_NEG_Rule" + str(i) + "_" + custFile
-        idxPOS, cust_pos_df = colMatchDDMPOS(cust_pos_df, pos_df, matchCondition, i)
-        idxNEG, cust_neg_df = colMatchDDMNEG(cust_neg_df, neg_df, matchCondition, i)
-        MatchedFiles(intFileDir, FileNamePOS, idxPOS)
-        MatchedFiles(intFileDir, custFilePOSPostMatch, cust_pos_df)
-        MatchedFiles(intFileDir, FileNameNEG, idxNEG)
-        MatchedFiles(intFileDir, custFileNEGPostMatch, cust_neg_df)
-        matched_idx = matched_idx.append(matchedIndex(idxNEG, idxPOS, matchCondition), ignore_index=True, sort=False)
-        matched_idx.sort_values(by=["ID_CUST"], inplace=True)
-        i += 1
+    # Criteria of the positive list have no blank between RULE and the rule number
+    streams = [(cust_pos_df, pos_df, posIndex, "POS", "DDM RULE"), (cust_neg_df, neg_df, negIndex, "NEG", "DDM RULE ")]
+    streamScores = {listName: None if scores is None else (ddmScore.scoreMatches, scores["CUST"], scores[listName]) for listName in ["POS", "NEG"]}
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(streams))) as executor:
+            futures = [executor.submit(ddmStream, cust, lst, matchConditions, custIndex, lstIndex, listName, rulePrefix, intFileDir, fileFormat, streamScores[listName]) for cust, lst, lstIndex, listName, rulePrefix in streams]
+            idxPOS, idxNEG = [future.result() for future in futures]
+    else:
+        idxPOS, idxNEG = [ddmStream(cust, lst, matchConditions, custIndex, lstIndex, listName, rulePrefix, intFileDir, fileFormat, streamScores[listName]) for cust, lst, lstIndex, listName, rulePrefix in streams]
+    matched_idx = [matchedIndex(idxNEG[i], idxPOS[i], matchCondition) for i, matchCondition in enumerate(matchConditions)]
+    # Matches of all the rules are sorted once, the matches of a customer stay in the order of the rules
+    if unchanged is not None:
+        # The carried matches are scored again, the previous run may have been without score
+        previous = previousMatches[previousMatches["ID_CUST"].isin(unchanged)].drop(columns="NEW_SCORE", errors="ignore").reset_index(drop=True)
+        if scores is not None:
+            previous = ddmScore.MatchScore(previous, scores["CUST"], scores["POS"], scores["NEG"])
+        matched_idx.append(previous)
+    matched_idx = pd.concat(matched_idx, ignore_index=True, sort=False)
+    matched_idx = matched_idx.sort_values(by=["ID_CUST"], kind="stable").reset_index(drop=True)
     cust_df = cust_df[~cust_df["ID"].isin(matched_idx["ID_CUST"])]
     print("End of DDM")
     return matched_idx, cust_df
@@ -409,47 +574,92 @@ def DDM(cust_df, neg_df, pos_df):
 if __name__ == "__main__":
     print("Data Load started: " + str(datetime.now()))
     cwd = os.getcwd()
-    srcFolder = cwd + r"\\Source\\"
-    print("CUSTOMER MONITORING LIST")
-    custFile = r"00_List_Customer_Monitoring.csv"
-    df_cust = extractSource(srcFolder, custFile)
-    print("NEGATIVE LIST")
-    negFile = r"01a_List_Negative.csv"
-    df_neg = extractSource(srcFolder, negFile)
-    print("POSITIVE LIST")
-    posFile = r"01b_List_Positive.csv"
-    df_pos = extractSource(srcFolder, posFile)
-    print("Data Load Completed: " + str(datetime.now()))
-    print(len(df_cust), len(df_neg), len(df_pos))
-    print("Data Preprocessing Started: " + str(datetime.now()))
-    print("CUSTOMER MONITORING LIST")
-    df_cust = dataPreprocessing(df_cust)
-    print("NEGATIVE LIST")
-    df_neg = dataPreprocessing1(df_neg)
-    print("POSITIVE LIST")
-    df_pos = dataPreprocessing1(df_pos)
-    print("Data Pre-processing Completed!!! " + str(datetime.now()))
-    print(len(df_cust), len(df_neg), len(df_pos))
-    print("Data load of preprocessed file started: " + str(datetime.now()))
-    intFileDir = cwd + r"\\IntermediateFiles\\Preprocessed\\"
-    ppCustFile = "PP_" + custFile
-    IntermediateFiles(intFileDir, ppCustFile, df_cust)
-    ppNegFile = "PP_" + negFile
-    IntermediateFiles(intFileDir, ppNegFile, df_neg)
-    ppPosFile = "PP_" + posFile
-    IntermediateFiles(intFileDir, ppPosFile, df_pos)
-    print("Data load of preprocessed file completed!!! " + str(datetime.now()))
-    print("Determistics Data Match started: " + str(datetime.now()))
-    index_df, df_cust = DDM(df_cust, df_neg, df_pos)
-    print("Determistics Data Match completed!!! " + str(datetime.now()))
-    print(len(df_cust), len(df_neg), len(df_pos))
-    print("Data load of DDM file started: " + str(datetime.now()))
-    intFileDir = cwd + r"\\IntermediateFiles\\DDM\\"
-    DDMFile = r"DDM.csv"
-    peCustFile = "DDM_" + custFile
-    MatchedFiles(intFileDir, DDMFile, index_df)
-    MatchedFiles(intFileDir, peCustFile, df_cust)
-    MatchedFiles(intFileDir, custFile, df_cust)
-    IntermediateFiles(intFileDir, negFile, df_neg)
-    IntermediateFiles(intFileDir, posFile, df_pos)
-    print("Data load of DDM file completed!!! " + str(datetime.now()))
+    # Format of the intermediate files shared between the scripts ("csv", "parquet" or "feather"), must be the same in all the scripts
+    fileFormat = "csv"
+    # Preprocess only the distinct values of each column and map them back to the rows
+    distinct = True
+    # Number of processes used for the preprocessing and to match the positive and the negative list (1 = one after another)
+    workers = os.cpu_count()
+    # Record based score of the matches computed during DDM and written to DDM1.csv, 03_RecordLinkageDDMScore.py is then only needed for backfills
+    score = False
+    # Reverse mode: after an update of the lists only their new or changed records are matched against the customer index of the previous run
+    reverse = False
+    # Customer index for the reverse mode, written by a normal run only if the reverse mode is used afterwards
+    reverseIndex = False
+    if reverse:
+        print("Reverse Data Match started: " + str(datetime.now()))
+        index_df = reverseScreening(cwd, fileFormat, workers, distinct)
+        print(len(index_df))
+        print("Reverse Data Match completed!!! " + str(datetime.now()))
+    else:
+        srcFolder = cwd + r"\\Source\\"
+        print("CUSTOMER MONITORING LIST")
+        custFile = r"00_List_Customer_Monitoring.csv"
+        df_cust = extractSource(srcFolder, custFile)
+        negFile = r"01a_List_Negative.csv"
+        posFile = r"01b_List_Positive.csv"
+        print("Data Load Completed: " + str(datetime.now()))
+        print(len(df_cust))
+        print("Data Preprocessing Started: " + str(datetime.now()))
+        print("CUSTOMER MONITORING LIST")
+        if workers > 1:
+            df_cust, = parallelPreprocessing([df_cust], workers, distinct)
+        else:
+            df_cust = dataPreprocessing(df_cust, distinct)
+        # Negative and positive list are loaded preprocessed from the watch-list index, which is only rebuilt when the source file changed
+        indexDir = cwd + r"\\IntermediateFiles\\Preprocessed\\"
+        print("NEGATIVE LIST")
+        df_neg, negIndex = watchList(srcFolder, negFile, "NEG", indexDir, workers, distinct)
+        print("POSITIVE LIST")
+        df_pos, posIndex = watchList(srcFolder, posFile, "POS", indexDir, workers, distinct)
+        print("Data Pre-processing Completed!!! " + str(datetime.now()))
+        print(len(df_cust), len(df_neg), len(df_pos))
+        print("Data load of preprocessed file started: " + str(datetime.now()))
+        intFileDir = cwd + r"\\IntermediateFiles\\Preprocessed\\"
+        ppCustFile = "PP_" + custFile
+        IntermediateFiles(intFileDir, ppCustFile, df_cust, fileFormat)
+        ppNegFile = "PP_" + negFile
+        IntermediateFiles(intFileDir, ppNegFile, df_neg, fileFormat)
+        ppPosFile = "PP_" + posFile
+        IntermediateFiles(intFileDir, ppPosFile, df_pos, fileFormat)
+        print("Data load of preprocessed file completed!!! " + str(datetime.now()))
+        # Delta mode: only the customers which are new or changed since the previous run are screened, the results of the unchanged customers are carried over
+        # (the matched files of the rules then only hold the new or changed customers)
+        delta = False
+        ddmDir = cwd + r"\\IntermediateFiles\\DDM\\"
+        stateFile = ddmDir + "Delta_DDM.pkl"
+        deltaFile = intFileDir + "Delta.pkl"
+        state = loadState(stateFile) if delta else None
+        fingerprints = pd.util.hash_pandas_object(df_cust, index=True)
+        listFingerprints = [fileFingerprint(srcFolder + negFile, preprocessingVersion), fileFingerprint(srcFolder + posFile, preprocessingVersion)]
+        rules = ruleFingerprint(ddmConditions(), missingValues)
+        unchanged = unchangedCustomers(state, fingerprints, listFingerprints, rules)
+        run = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        if reverseIndex:
+            # Customer index for the reverse mode, keyed by the key of every DDM rule, with the versions of the lists screened by this run
+            saveCustomerIndex(ddmDir + "CI_DDM", *customerIndex(df_cust, ddmConditions()), {"NEG": recordHashes(df_neg), "POS": recordHashes(df_pos)})
+        print("Determistics Data Match started: " + str(datetime.now()))
+        if unchanged is None:
+            index_df, df_cust = DDM(df_cust, df_neg, df_pos, fileFormat, workers, negIndex, posIndex, score=score)
+        else:
+            print(str(len(df_cust) - len(unchanged)) + " new or changed customers")
+            index_df, df_cust = DDM(df_cust, df_neg, df_pos, fileFormat, workers, negIndex, posIndex, unchanged, state["matches"], score)
+        # The scripts 02 to 04 carry over their previous results only if they belong to the base run of this one (and not at all without delta mode)
+        if delta:
+            pd.to_pickle({"run": run, "fingerprints": fingerprints, "lists": listFingerprints, "rules": rules, "matches": index_df}, stateFile)
+        pd.to_pickle({"run": run, "base": None if unchanged is None else state["run"], "unchanged": unchanged} if delta else None, deltaFile)
+        print("Determistics Data Match completed!!! " + str(datetime.now()))
+        print(len(df_cust), len(df_neg), len(df_pos))
+        print("Data load of DDM file started: " + str(datetime.now()))
+        intFileDir = cwd + r"\\IntermediateFiles\\DDM\\"
+        DDMFile = r"DDM.csv"
+        peCustFile = "DDM_" + custFile
+        MatchedFiles(intFileDir, DDMFile, index_df, fileFormat)
+        if score:
+            # Same file as written by 03_RecordLinkageDDMScore.py (always csv)
+            MatchedFiles(intFileDir, r"DDM1.csv", index_df)
+        MatchedFiles(intFileDir, peCustFile, df_cust, fileFormat)
+        MatchedFiles(intFileDir, custFile, df_cust, fileFormat)
+        IntermediateFiles(intFileDir, negFile, df_neg, fileFormat)
+        IntermediateFiles(intFileDir, posFile, df_pos, fileFormat)
+        print("Data load of DDM file completed!!! " + str(datetime.now()))
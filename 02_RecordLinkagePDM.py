@@ -3,7 +3,7 @@
 
 ## IMPORTANT: FOLDER STRUCTURE ##
 Below mentioned folder structure must be followed for getting the results from this script:
-01. Script must be placed into a folder known as main folder
+01. Script must be placed into a folder known as main folder, together with RecordLinkageCommon.py (functions shared by the scripts) and RecordLinkageScore.py (record based score)
 02. Source files (3 lists) must be placed into the Source folder under main folder
 03. a folder named as IntermediateFiles must be created under main folder with below mentioned sub-folders
     A. Source
@@ -28,18 +28,44 @@ This script performs probablistic data matching between customer list and negati
 
 # Load required packages
 import os
+import importlib
 import pandas as pd
-import recordlinkage
+import numpy as np
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from collections import OrderedDict
+from sklearn.feature_extraction.text import TfidfVectorizer
+from RecordLinkageCommon import sentinelValues, readCSV, columnarFile, readColumnar, IntermediateFiles, MatchedFiles, matchedIndex, keyHash, sameKeys, probeIndex, mergeOrder, fileFingerprint, loadWatchList, saveWatchList, recordHashes, changedRecords, saveCustomerIndex, loadCustomerIndex, loadState, ruleFingerprint, carriedCustomers, saveState
+# Module of the record based score of the matches (shared with 04_RecordLinkagePDMScore.py), only imported with the score option of PDM
+scoreModule = "RecordLinkageScore"
 
+# Minimum Jarowinkler similarity of a partial match
+partialThreshold = 0.76
+# Jarowinkler similarities of the string pairs (customer value, list value) compared during a run, shared by all the rules and lists matched in the same process.
+# The least recently used pairs are evicted above maxSize
+similarityCache = {"pairs": OrderedDict(), "maxSize": 500000, "hits": 0, "misses": 0}
+# Number of string pairs of the partial matches during a run, in total and removed by every filter before the Jarowinkler similarity is looked up or computed
+pruningCounters = {"pairs": 0, "missing": 0, "equal": 0, "length": 0, "prefix": 0, "histogram": 0, "compared": 0}
+# Memory budget (bytes) of the candidate pairs of a PDM rule compared at once (per worker of the process pool), the candidates are streamed in chunks within this budget
+candidateMemory = 256 * 2 ** 20
+# Minimum number of candidate pairs of a partition compared in the process pool, the candidates of smaller rules are compared in the main process
+partitionPairs = 50000
+# Negative and positive list of a worker of the process pool, set once per worker by initPartitions
+partitionLists = {}
+# Blocking keys which the PDM rules can use besides the columns: the Kölner Phonetik codes of the names and the street (key: column)
+phoneticKeys = {"FIRST_NAME_PHONETIC": "FIRST_NAME", "LAST_NAME_PHONETIC": "LAST_NAME", "STREET_PHONETIC": "STREET", "CITY_PHONETIC": "CITY"}
 
-def extractSource(dir, files):
+
+def extractSource(dir, files, memoryMap=False, fileFormat="csv"):
     ''' 
     Function to extract Data from files in a specific format
     '''
-    t = {"FIRST_NAME": object, "FIRST_NAME": object, "LAST_NAME": object, "DOB": object, "STREET": object, "ZIP": object, "CITY": object, "HNRNEW": object}
+    t = {"FIRST_NAME": object, "FIRST_NAME": object, "LAST_NAME": object, "STREET": object, "ZIP": object, "CITY": object, "HNRNEW": object}
     filename = dir + files
-    df = pd.read_csv(filename, index_col = "ID", na_values = ['1900-00-00', '1800-00-00', '1700-00-00', '-99999', '-88888', '-77777'], dtype=t)
+    if fileFormat != "csv":
+        return readColumnar(filename, fileFormat)
+    df = readCSV(filename, t, dates=["DOB"], naValues=sentinelValues, memoryMap=memoryMap)
     df['DOB'] = pd.to_datetime(df['DOB'], format='%Y-%m-%d')
     return df
 
@@ -62,85 +88,617 @@ def combineAddress(df):
     return df
 
 
-def IntermediateFiles(dir, file, df):
+def koelnerPhonetik(value):
     '''
-    Function to create intermediate files post a specific operation like Data Preprocessing with index values
+    Function to compute the Kölner Phonetik code of a string (German phonetic code, umlauts count as their vowel and other characters than letters are ignored)
     '''
-    originalFiles = ["00_List_Customer_Monitoring.csv", "01a_List_Negative.csv", "01b_List_Positive.csv"]
-    if file in originalFiles:
-        file = file
-    else:
-        file = datetime.now().strftime("%Y%m%d") + "_" + file
-    filename = dir + file
-    df.to_csv(filename)
+    word = "".join(c for c in value.upper().translate(str.maketrans("ÄÖÜß", "AOUS")) if "A" <= c <= "Z")
+    code = ""
+    for i, c in enumerate(word):
+        before = word[i - 1] if i > 0 else ""
+        after = word[i + 1] if i + 1 < len(word) else ""
+        if c in "AEIJOUY":
+            digits = "0"
+        elif c == "H":
+            digits = ""
+        elif c == "B" or (c == "P" and after != "H"):
+            digits = "1"
+        elif c in "DT":
+            digits = "8" if after and after in "CSZ" else "2"
+        elif c in "FPVW":
+            digits = "3"
+        elif c in "GKQ":
+            digits = "4"
+        elif c == "C" and i == 0:
+            digits = "4" if after and after in "AHKLOQRUX" else "8"
+        elif c == "C":
+            digits = "4" if after and after in "AHKOQUX" and not (before and before in "SZ") else "8"
+        elif c == "X":
+            digits = "8" if before and before in "CKQ" else "48"
+        elif c == "L":
+            digits = "5"
+        elif c in "MN":
+            digits = "6"
+        elif c == "R":
+            digits = "7"
+        else:
+            digits = "8"
+        for digit in digits:
+            if not code or code[-1] != digit:
+                code += digit
+    # Vowels are only kept at the start
+    return code[:1] + code[1:].replace("0", "")
 
 
-def MatchedFiles(dir, file, df):
+def phoneticCode(value):
     '''
-    Function to create intermediate files post a specific operation like Data Preprocessing without index values
+    Function to get the Kölner Phonetik code of a value as blocking key, NaN for a missing value or a value without letters
     '''
-    originalFiles = ["00_List_Customer_Monitoring.csv", "01a_List_Negative.csv", "01b_List_Positive.csv"]
-    if file in originalFiles:
-        file = file
-    else:
-        file = datetime.now().strftime("%Y%m%d") + "_" + file
-    filename = dir + file
-    df.to_csv(filename, index=False)
+    code = koelnerPhonetik(value) if type(value) == str else ""
+    return code if code else np.nan
 
 
-def indexBlocker(index, df, lst):
+def blockingValues(df, col):
     '''
-    Function to create index before performing PDM for quick completion
+    Function to get the values of a blocking key, a column or the Kölner Phonetik codes of a column (phoneticKeys), taken from the column of the codes if added by phoneticColumns
     '''
-    indexer = recordlinkage.Index()
-    indexer.block(left_on = index, right_on = index)
-    candidates = indexer.index(df, lst)
-    return candidates
+    if col not in phoneticKeys or col in df:
+        return df[col]
+    # Every distinct value is coded once
+    codes, uniques = pd.factorize(df[phoneticKeys[col]].astype(object).to_numpy())
+    values = np.append(np.array([phoneticCode(value) for value in uniques], dtype=object), np.nan)[codes]
+    return pd.Series(values, index=df.index, name=col, dtype=object)
+
+
+def blockingFrame(df, cols):
+    '''
+    Function to get the values of the blocking keys (cols) of the records
+    '''
+    return pd.DataFrame({col: blockingValues(df, col) for col in cols}, index=df.index)
+
+
+def phoneticColumns(df, conditions):
+    '''
+    Function to add the phonetic blocking keys (phoneticKeys) of the PDM rules (conditions) as columns, so that the Kölner Phonetik codes are computed once per run
+    '''
+    for col in dict.fromkeys(col for condition in conditions for col in condition[0] if col in phoneticKeys):
+        df[col] = blockingValues(df, col)
+    return df
+
+
+def blockingOptions(condition):
+    '''
+    Function to get the blocking options of a PDM rule (optional fifth element of the rule), empty if the rule blocks on equal keys:
+    "window" for a sorted-neighbourhood blocking on the last blocking column, or "ngrams" (NAME or ADDRESS), "topK" and "minSimilarity" for the retrieval of the list records
+    with the most similar character n-grams of the column among the list records with the same blocking keys
+    '''
+    return condition[4] if len(condition) > 4 else {}
+
+
+def blockingIndex(df, cols):
+    '''
+    Function to compute a 64-bit hash of every blocking column used by the PDM rules once per record
+    '''
+    index = pd.DataFrame(index=df.index)
+    for col in cols:
+        # Only the distinct values are hashed, as objects so that a DOB gets the same hash in datetime and in mixed (date and sentinel) columns
+        codes, uniques = pd.factorize(blockingValues(df, col).astype(object).to_numpy())
+        # Missing values (code -1) get the hash 0 appended at the end
+        index[col] = np.append(pd.util.hash_array(uniques, categorize=False), np.uint64(0))[codes]
+    return index
+
+
+def keyIndex(df, index, cols):
+    '''
+    Function to get the blocking index of the records for the blocking keys (cols), computed if not given (index is None) or if it misses a blocking key (e.g. a phonetic key)
+    '''
+    if index is None or not set(cols) <= set(index.columns):
+        index = blockingIndex(df, cols)
+    return index
 
 
-def matchedIndex(nmatch, pmatch, rule):
+def ngramIndex(values, ngramSize=3):
     '''
-    Function to append customers matched with negative list to the customers matched with positive list
+    Function to build the TF-IDF character n-gram index of the values of a list column: the vectorizer and the n-gram matrix (n-grams x records, rows of the records normalized)
+    Returns None for the matrix if the values have no n-gram
     '''
-    match = nmatch.append(pmatch, ignore_index=True, sort=False)
-    match = match[["ID_CUST", "ID_NEG", "ID_POS", "MATCH_CRITERIA", "MATCH_SCORE"]]
-    match.sort_values(by=["ID_CUST"], inplace=True)
-    match = match.reset_index()
-    match = match.drop("index", axis = 1)
+    vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(ngramSize, ngramSize), dtype=np.float32)
+    try:
+        matrix = vectorizer.fit_transform(values.astype(str)).T.tocsr()
+    except ValueError:
+        matrix = None
+    return vectorizer, matrix
+
+
+def topSimilar(similarity, topK, minSimilarity, rowKeys=None, colKeys=None):
+    '''
+    Function to get the pairs (row, column) of the topK largest values of every row of a sparse similarity matrix of at least minSimilarity, in order of row and column.
+    Values equal to the topK largest value of the row are all kept.
+    The values can be restricted to the columns with the same key as the row (rowKeys and colKeys)
+    '''
+    similarity = similarity.tocoo()
+    keep = similarity.data >= minSimilarity
+    if rowKeys is not None:
+        keep &= rowKeys[similarity.row] == colKeys[similarity.col]
+    rows, cols, data = similarity.row[keep], similarity.col[keep], similarity.data[keep]
+    # Most similar first, the topK largest value of every row with at least topK values is the lower bound of its row
+    order = np.lexsort((-data, rows))
+    rows, data = rows[order], data[order]
+    start = np.searchsorted(rows, rows, side="left")
+    counts = np.searchsorted(rows, rows, side="right") - start
+    bound = np.where(counts > topK, data[np.minimum(start + topK - 1, max(len(data) - 1, 0))], -np.inf)
+    keep = data >= bound
+    rows, cols = rows[keep], cols[order][keep]
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order]
+
+
+def listBlocking(index, lst, lstIndex=None, options={}):
+    '''
+    Function to prepare the list records with a complete blocking key (index) for the blocking of a PDM rule (options of blockingOptions): sorted on the key hashes,
+    or with a sorted-neighbourhood window on the position of the value of the last blocking key among the distinct values of the block (the other blocking keys), or indexed by the n-grams of a column.
+    The blocking key hashes of the list (lstIndex) are computed if not given or if they miss a blocking key
+    '''
+    lstIndex = keyIndex(lst, lstIndex, index)
+    right = np.flatnonzero(blockingFrame(lst, index).notna().all(axis=1).to_numpy())
+    if "ngrams" in options:
+        right = right[lst[options["ngrams"]].notna().to_numpy()[right]]
+        vectorizer, matrix = ngramIndex(lst[options["ngrams"]].to_numpy()[right], options.get("ngramSize", 3))
+        return {"right": right, "key": keyHash(lstIndex, index)[right], "ngrams": options["ngrams"], "vectorizer": vectorizer, "matrix": matrix, "topK": options.get("topK", 10), "minSimilarity": options.get("minSimilarity", 0.5)}
+    if "window" not in options:
+        key = keyHash(lstIndex, index)[right]
+        sorter = np.argsort(key, kind="stable")
+        return {"right": right, "sorter": sorter, "sortedKey": key[sorter], "window": None}
+    blocks, blockCodes = np.unique(keyHash(lstIndex, index[:-1])[right], return_inverse=True)
+    values, ranks = np.unique(blockingValues(lst, index[-1]).to_numpy()[right], return_inverse=True)
+    # Every distinct (block, value) pair gets its position in order of block and value, so that the window only counts the values of the same block
+    blockValues, key = np.unique(blockCodes.astype(np.int64) * (len(values) + 1) + ranks, return_inverse=True)
+    sorter = np.argsort(key, kind="stable")
+    return {"right": right, "sorter": sorter, "sortedKey": key[sorter], "window": options["window"], "blocks": blocks, "values": values, "blockValues": blockValues}
+
+
+def probeNgrams(listPlan, index, df, dfIndex=None):
+    '''
+    Function to retrieve for every record with a complete blocking key (index) and a value of the n-gram column the topK list records (listPlan of listBlocking) with the same blocking key hash
+    and the largest cosine similarity of the TF-IDF n-grams of at least minSimilarity, by sparse matrix products of chunks of records within candidateMemory
+    '''
+    col = listPlan["ngrams"]
+    if dfIndex is None:
+        dfIndex = blockingIndex(df, index)
+    left = np.flatnonzero((blockingFrame(df, index).notna().all(axis=1) & df[col].notna()).to_numpy())
+    key = keyHash(dfIndex, index)[left]
+    rows = [np.empty(0, dtype=np.int64)]
+    cols = [np.empty(0, dtype=np.int64)]
+    if listPlan["matrix"] is not None:
+        values = df[col].to_numpy()[left].astype(str)
+        # A row of the product has at most one similarity (float32 and index) per list record
+        chunkSize = max(1, candidateMemory // (12 * listPlan["matrix"].shape[1] + 1))
+        for first in range(0, len(left), chunkSize):
+            similarity = listPlan["vectorizer"].transform(values[first:first + chunkSize]) @ listPlan["matrix"]
+            row, column = topSimilar(similarity, listPlan["topK"], listPlan["minSimilarity"], key[first:first + chunkSize], listPlan["key"])
+            rows.append(row.astype(np.int64) + first)
+            cols.append(column.astype(np.int64))
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    counts = np.bincount(rows, minlength=len(left))
+    # Every record is a block of its own
+    return {"left": left, "leftHash": np.arange(len(left)), "sorter": cols, "start": np.cumsum(counts) - counts, "counts": counts}
+
+
+def probeBlocking(listPlan, index, df, dfIndex=None):
+    '''
+    Function to find the candidates of every record with a complete blocking key (index) in the list records prepared by listBlocking (listPlan):
+    the first candidate (start) in the sorted list records (sorter) and the number of candidates.
+    With a sorted-neighbourhood window the candidates of a record are the list records with the same other blocking keys and one of the window nearest values of the last blocking key
+    within this block (window // 2 values of the block on either side of the value of the record, the value itself if it is in the block), with n-grams they are retrieved by probeNgrams
+    '''
+    if "ngrams" in listPlan:
+        return probeNgrams(listPlan, index, df, dfIndex)
+    if dfIndex is None:
+        dfIndex = blockingIndex(df, index)
+    left = np.flatnonzero(blockingFrame(df, index).notna().all(axis=1).to_numpy())
+    sortedKey = listPlan["sortedKey"]
+    if listPlan["window"] is None:
+        key = keyHash(dfIndex, index)[left]
+        start = np.searchsorted(sortedKey, key, side="left")
+        return {"left": left, "leftHash": key, "sorter": listPlan["sorter"], "start": start, "counts": np.searchsorted(sortedKey, key, side="right") - start}
+    blocks, values, blockValues = listPlan["blocks"], listPlan["values"], listPlan["blockValues"]
+    blockHash = keyHash(dfIndex, index[:-1])[left]
+    blockCode = np.minimum(np.searchsorted(blocks, blockHash), max(len(blocks) - 1, 0))
+    found = (blockCode < len(blocks)) & (blocks[blockCode] == blockHash) if len(blocks) else np.zeros(len(left), dtype=bool)
+    value = blockingValues(df, index[-1]).to_numpy()[left]
+    rank = np.searchsorted(values, value, side="left")
+    inList = (rank < len(values)) & (values[np.minimum(rank, max(len(values) - 1, 0))] == value) if len(values) else np.zeros(len(left), dtype=bool)
+    blockValue = blockCode.astype(np.int64) * (len(values) + 1) + rank
+    # Position of the value among the (block, value) pairs of the list and the positions of the first and after the last value of the block
+    pos = np.searchsorted(blockValues, blockValue, side="left")
+    inBlock = inList & (blockValues[np.minimum(pos, max(len(blockValues) - 1, 0))] == blockValue) if len(blockValues) else np.zeros(len(left), dtype=bool)
+    first = np.searchsorted(blockValues, blockCode.astype(np.int64) * (len(values) + 1), side="left")
+    last = np.searchsorted(blockValues, (blockCode.astype(np.int64) + 1) * (len(values) + 1), side="left") - 1
+    half = listPlan["window"] // 2
+    low = np.maximum(pos - half, first)
+    high = np.minimum(np.where(inBlock, pos + half, pos + half - 1), last)
+    start = np.searchsorted(sortedKey, low, side="left")
+    counts = np.where(found & (high >= low), np.searchsorted(sortedKey, high, side="right") - start, 0)
+    return {"left": left, "leftHash": blockValue, "sorter": listPlan["sorter"], "start": start, "counts": counts}
+
+
+def blockingPlan(index, df, lst, lstIndex=None, options={}):
+    '''
+    Function to count the candidates of every customer with a complete blocking key (index) of a PDM rule, before any candidate pair is materialized.
+    The candidates of the customers follow each other, in order of the customer and then of the list record
+    '''
+    listPlan = listBlocking(index, lst, lstIndex, options)
+    plan = probeBlocking(listPlan, index, df)
+    plan.update({"right": listPlan["right"], "ends": np.cumsum(plan["counts"])})
+    return plan
+
+
+def candidateReport(plan):
+    '''
+    Function to get the candidate counts of a blocking plan: the number of candidate pairs, of blocks (blocking keys or neighbourhoods with candidates) and the number of pairs of the largest block
+    '''
+    hits = plan["counts"] > 0
+    blocks = np.bincount(pd.factorize(plan["leftHash"][hits])[0], weights=plan["counts"][hits])
+    return {"pairs": int(plan["counts"].sum()), "blocks": len(blocks), "largestBlock": int(blocks.max()) if len(blocks) else 0}
+
+
+def candidatePairs(plan, first, last):
+    '''
+    Function to materialize the candidate pairs first to last of a blocking plan as int32 positions in the customers and list records with a complete blocking key
+    '''
+    return pairRows(plan, np.arange(first, last))
+
+
+def pairRows(plan, pairs):
+    '''
+    Function to materialize the candidate pairs (numbers of the pairs in order) of a blocking plan as int32 positions in the customers and list records with a complete blocking key
+    '''
+    leftRow = np.searchsorted(plan["ends"], pairs, side="right")
+    rightRow = plan["sorter"][plan["start"][leftRow] + pairs - plan["ends"][leftRow] + plan["counts"][leftRow]]
+    return leftRow.astype(np.int32), rightRow.astype(np.int32)
+
+
+def encodeStrings(values):
+    '''
+    Function to encode an array of strings as a matrix of unicode code points (one row per string, padded with 0) and the lengths of the strings
+    '''
+    values = np.ascontiguousarray(values, dtype=str)
+    codes = values.view(np.uint32).reshape(len(values), values.dtype.itemsize // 4)
+    return codes, np.char.str_len(values)
+
+
+def jaroWinkler(left, right):
+    '''
+    Function to compute the Jarowinkler similarity of the pairs of strings (left[k], right[k]) for all the pairs at once, same values as jellyfish.jaro_winkler_similarity.
+    The characters of left are matched one after another with the first unmatched equal character of right within the search range, for all the pairs in one step
+    '''
+    c1, l1 = encodeStrings(left)
+    c2, l2 = encodeStrings(right)
+    searchRange = np.maximum(np.maximum(l1, l2) // 2 - 1, 0)
+    maxRange = searchRange.max() if len(searchRange) else 0
+    flags1 = np.zeros(c1.shape, dtype=bool)
+    flags2 = np.zeros(c2.shape, dtype=bool)
+    for i in range(min(c1.shape[1], c2.shape[1] + maxRange)):
+        lo = max(0, i - maxRange)
+        hi = min(c2.shape[1], i + maxRange + 1)
+        j = np.arange(lo, hi)
+        window = (np.abs(j - i) <= searchRange[:, None]) & (j < l2[:, None]) & (i < l1)[:, None]
+        hit = window & ~flags2[:, lo:hi] & (c2[:, lo:hi] == c1[:, i:i + 1])
+        found = np.flatnonzero(hit.any(axis=1))
+        flags1[found, i] = True
+        flags2[found, lo + hit[found].argmax(axis=1)] = True
+    common = flags1.sum(axis=1)
+    # The k-th matched character of left is compared with the k-th matched character of right
+    width = min(c1.shape[1], c2.shape[1])
+    matched1 = np.take_along_axis(c1, np.argsort(~flags1, axis=1, kind="stable"), axis=1)[:, :width]
+    matched2 = np.take_along_axis(c2, np.argsort(~flags2, axis=1, kind="stable"), axis=1)[:, :width]
+    transpositions = ((matched1 != matched2) & (np.arange(width) < common[:, None])).sum(axis=1) // 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaro = (common / l1 + common / l2 + (common - transpositions) / common) / 3
+    jaro = np.where(common > 0, jaro, 0.0)
+    # Common prefix of up to 4 characters
+    width = min(4, width)
+    prefix = np.cumprod((c1[:, :width] == c2[:, :width]) & (np.arange(width) < np.minimum(l1, l2)[:, None]), axis=1).sum(axis=1)
+    return np.where(jaro > 0.7, jaro + prefix * 0.1 * (1.0 - jaro), jaro)
+
+
+def similarityBound(common, l1, l2, prefix):
+    '''
+    Function to compute an upper bound of the Jarowinkler similarity of pairs of strings (lengths l1 and l2) with at most common matching characters and a common prefix (at most 4)
+    (all the matching characters without transpositions)
+    '''
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bound = np.where(common > 0, (common / l1 + common / l2 + 1) / 3, 0.0)
+    return np.where(bound > 0.7, bound + prefix * 0.1 * (1.0 - bound), bound)
+
+
+def characterHistograms(codes):
+    '''
+    Function to count the characters of strings encoded by encodeStrings (one row of 128 counts per string, the code points are folded into 128 bins)
+    '''
+    rows = np.broadcast_to(np.arange(len(codes))[:, None], codes.shape)
+    chars = codes > 0
+    return np.bincount(rows[chars] * 128 + codes[chars] % 128, minlength=len(codes) * 128).reshape(len(codes), 128).astype(np.int16)
+
+
+def prunePairs(leftUniques, rightUniques, leftCodes, rightCodes, weights, threshold, chunkSize=100000, counters=pruningCounters):
+    '''
+    Function to flag the distinct pairs of strings (leftUniques[leftCodes[k]], rightUniques[rightCodes[k]]) which can reach the threshold, with upper bounds of the similarity
+    from the lengths, the common prefix and the common characters (histograms) one after another. The pairs (weights of the distinct pairs) removed by every filter are counted
+    '''
+    c1, l1 = encodeStrings(leftUniques)
+    c2, l2 = encodeStrings(rightUniques)
+    l1, l2 = l1[leftCodes], l2[rightCodes]
+    common = np.minimum(l1, l2)
+    keep = similarityBound(common, l1, l2, 4) >= threshold - 1e-9
+    counters["length"] += int(weights[~keep].sum())
+    pos = np.flatnonzero(keep)
+    width = min(4, c1.shape[1], c2.shape[1])
+    prefix = np.cumprod((c1[leftCodes[pos], :width] == c2[rightCodes[pos], :width]) & (np.arange(width) < common[pos, None]), axis=1).sum(axis=1)
+    keep[pos] = similarityBound(common[pos], l1[pos], l2[pos], prefix) >= threshold - 1e-9
+    counters["prefix"] += int(weights[pos[~keep[pos]]].sum())
+    prefix = prefix[keep[pos]]
+    pos = np.flatnonzero(keep)
+    h1, h2 = characterHistograms(c1), characterHistograms(c2)
+    for start in range(0, len(pos), chunkSize):
+        chunk = pos[start:start + chunkSize]
+        # Matching characters are equal, so there are not more of them than common characters
+        shared = np.minimum(h1[leftCodes[chunk]], h2[rightCodes[chunk]]).sum(axis=1)
+        keep[chunk] = similarityBound(shared, l1[chunk], l2[chunk], prefix[start:start + chunkSize]) >= threshold - 1e-9
+    counters["histogram"] += int(weights[pos[~keep[pos]]].sum())
+    return keep
+
+
+def partialMatches(left, right, threshold, chunkSize=100000, counters=pruningCounters):
+    '''
+    Function to flag the pairs of strings (left[k], right[k]) with a Jarowinkler similarity of at least the threshold, a missing value is never a match.
+    Equal strings match without computation, every distinct pair is computed once and only if it can reach the threshold (prunePairs)
+    '''
+    match = np.zeros(len(left), dtype=bool)
+    valid = np.flatnonzero(pd.notna(left) & pd.notna(right))
+    counters["pairs"] += len(left)
+    counters["missing"] += len(left) - len(valid)
+    left = np.asarray(left, dtype=object)[valid]
+    right = np.asarray(right, dtype=object)[valid]
+    l1 = np.fromiter(map(len, left), dtype=np.int64, count=len(left))
+    l2 = np.fromiter(map(len, right), dtype=np.int64, count=len(right))
+    same = (left == right) & (l1 > 0)
+    match[valid[same]] = True
+    counters["equal"] += int(same.sum())
+    # A pair with an empty string has the similarity 0
+    rest = np.flatnonzero(~same & (l1 > 0) & (l2 > 0))
+    counters["length"] += len(left) - int(same.sum()) - len(rest)
+    if len(rest) == 0:
+        return match
+    leftCodes, leftUniques = pd.factorize(left[rest])
+    rightCodes, rightUniques = pd.factorize(right[rest])
+    pairs, first, inverse = np.unique(leftCodes.astype(np.int64) * len(rightUniques) + rightCodes, return_index=True, return_inverse=True)
+    weights = np.bincount(inverse, minlength=len(pairs))
+    leftCodes, rightCodes = leftCodes[first], rightCodes[first]
+    keep = np.flatnonzero(prunePairs(leftUniques, rightUniques, leftCodes, rightCodes, weights, threshold, chunkSize, counters))
+    counters["compared"] += int(weights[keep].sum())
+    similar = np.zeros(len(pairs), dtype=bool)
+    similar[keep] = cachedSimilarities(leftUniques[leftCodes[keep]], rightUniques[rightCodes[keep]], chunkSize) >= threshold
+    match[valid[rest]] = similar[inverse]
     return match
 
 
-def recordMatchesPDM(candidates, df, lst, exactCols, partialCols):
+def cachedSimilarities(left, right, chunkSize=100000, cache=similarityCache):
     '''
-    Function to get potential matches from customer list and positive/negative list using Jarowinkler algorithm with 76% and above similarity
+    Function to get the Jarowinkler similarities of distinct string pairs (left[k], right[k]) from the similarity cache, only the pairs which are not in the cache are computed with jaroWinkler
+    '''
+    pairs = cache["pairs"]
+    similarity = np.empty(len(left))
+    missing = []
+    for k, pair in enumerate(zip(left, right)):
+        value = pairs.get(pair)
+        if value is None:
+            missing.append(k)
+        else:
+            pairs.move_to_end(pair)
+            similarity[k] = value
+    cache["hits"] += len(left) - len(missing)
+    cache["misses"] += len(missing)
+    missing = np.array(missing, dtype=np.int64)
+    for start in range(0, len(missing), chunkSize):
+        chunk = missing[start:start + chunkSize]
+        similarity[chunk] = jaroWinkler(left[chunk], right[chunk])
+    pairs.update(zip(zip(left[missing], right[missing]), similarity[missing].tolist()))
+    while len(pairs) > cache["maxSize"]:
+        pairs.popitem(last=False)
+    return similarity
+
+
+def cacheStatistics(cache=similarityCache):
+    '''
+    Function to get the hit-rate statistics of the similarity cache (lookups of distinct string pairs)
+    '''
+    lookups = cache["hits"] + cache["misses"]
+    return {"hits": cache["hits"], "misses": cache["misses"], "hitRate": cache["hits"] / lookups if lookups else 0.0, "size": len(cache["pairs"])}
+
+
+def pairMatches(df, lst, left, right, exactCols, partialCols):
+    '''
+    Function to flag the pairs of customers and list records (positions left[k] and right[k]) with exact matches on exactCols and partial matches on partialCols.
+    The columns are compared one after another on the arrays of all the pairs which still match, the exact matches first and then the partial matches in the given order
+    (same matches as recordlinkage.Compare)
+    '''
+    match = np.ones(len(left), dtype=bool)
+    for col in exactCols:
+        pos = np.flatnonzero(match)
+        leftValues = df[col].to_numpy()[left[pos]]
+        rightValues = lst[col].to_numpy()[right[pos]]
+        match[pos] = pd.notna(leftValues) & pd.notna(rightValues) & (leftValues == rightValues)
+    for col in partialCols:
+        pos = np.flatnonzero(match)
+        match[pos] = partialMatches(df[col].to_numpy()[left[pos]], lst[col].to_numpy()[right[pos]], partialThreshold)
+    return match
+
+
+def comparisonOrder(df, lst, left, right, exactCols, partialCols, sampleSize=2000):
+    '''
+    Function to order the partial match columns by increasing expected cost per rejected pair, estimated on a sample of the pairs (positions left and right) with exact matches:
+    the share of the pairs whose similarity is computed (not pruned) divided by the share of the pairs without partial match
+    '''
+    if len(partialCols) < 2 or len(left) == 0:
+        return partialCols
+    sample = np.unique(np.linspace(0, len(left) - 1, min(sampleSize, len(left))).astype(np.int64))
+    left, right = left[sample], right[sample]
+    alive = pairMatches(df, lst, left, right, exactCols, [])
+    left, right = left[alive], right[alive]
+    costs = {}
+    for col in partialCols:
+        counters = dict.fromkeys(pruningCounters, 0)
+        match = partialMatches(df[col].to_numpy()[left], lst[col].to_numpy()[right], partialThreshold, counters=counters)
+        # Pruning a pair costs a small fraction of a similarity
+        costs[col] = (0.05 + counters["compared"] / max(len(left), 1)) / max(1 - match.mean() if len(left) else 1.0, 1e-3)
+    return sorted(partialCols, key=lambda col: costs[col])
+
+
+def potentialMatches(candidates, exactCols, partialCols):
+    '''
+    Function to create the potential matches (with the scores of recordlinkage.Compare) of the matching candidate pairs
     '''
-    compare = recordlinkage.Compare()
+    pot_matches = pd.DataFrame(index=candidates).reset_index()
     for col in exactCols:
-        lbl = col + '_SCORE'
-        compare.exact(col, col, label=lbl)
+        pot_matches[col + '_SCORE'] = 1
     for col in partialCols:
-        lbl = col + '_SCORE'
-        compare.string(col, col, method='jarowinkler', threshold = 0.76, label = lbl)
-    features = compare.compute(candidates, df, lst)
-    pot_matches = features[features.sum(axis=1) > 1].reset_index()
-    pot_matches['SCORE'] = pot_matches.iloc[:, 2:].sum(axis = 1)
+        pot_matches[col + '_SCORE'] = 1.0
     numberOfMatches = len(exactCols) + len(partialCols)
-    pot_matches = pot_matches[pot_matches['SCORE'] == numberOfMatches]
+    pot_matches['SCORE'] = float(numberOfMatches)
     return pot_matches
 
 
-def colMatchPDMPOS(cust, pos, index, exact, partial, i, score):
+def recordMatchesPDM(candidates, df, lst, exactCols, partialCols):
+    '''
+    Function to get potential matches from customer list and positive/negative list using Jarowinkler algorithm with 76% and above similarity
+    '''
+    left = df.index.get_indexer(candidates.get_level_values(0))
+    right = lst.index.get_indexer(candidates.get_level_values(1))
+    partialOrder = comparisonOrder(df, lst, left, right, exactCols, partialCols)
+    return potentialMatches(candidates[pairMatches(df, lst, left, right, exactCols, partialOrder)], exactCols, partialCols)
+
+
+def compareChunk(df, lst, leftPos, rightPos, sameCols, exactCols, partialCols):
+    '''
+    Function to flag the candidate pairs (positions leftPos and rightPos) with equal blocking keys (sameCols) and the exact and partial matches of a PDM rule
+    '''
+    keep = sameKeys(df, lst, sameCols, leftPos, rightPos, blockingValues)
+    keep[keep] = pairMatches(df, lst, leftPos[keep], rightPos[keep], exactCols, partialCols)
+    return keep
+
+
+def initPartitions(lists):
+    '''
+    Function to initialize a worker of the process pool of the PDM partitions with the negative and positive list (dict of the list names and lists)
+    '''
+    partitionLists.update(lists)
+
+
+def comparePartition(listName, df, leftPos, rightPos, sameCols, exactCols, partialCols):
+    '''
+    Function to compare a partition of the candidate pairs of a PDM rule in a worker of the process pool (compareChunk with the customers of the partition df),
+    returns the flags of the matching pairs and what the partition added to the pruning counters and the hits and misses of the similarity cache of the worker
+    '''
+    counters = dict(pruningCounters, hits=similarityCache["hits"], misses=similarityCache["misses"])
+    keep = compareChunk(df, partitionLists[listName], leftPos, rightPos, sameCols, exactCols, partialCols)
+    after = dict(pruningCounters, hits=similarityCache["hits"], misses=similarityCache["misses"])
+    return keep, {name: after[name] - counters[name] for name in counters}
+
+
+def partitionResults(pool, df, pairs, plan, sameCols, exactCols, partialCols):
+    '''
+    Function to compare the partitions of the candidate pairs of a PDM rule (leftRow and rightRow of candidatePairs) in the process pool and yield the matching pairs of every partition
+    in the order of the partitions. Only the customers of a partition are sent to the workers, which hold the lists, and at most two partitions per worker are pending at once
+    '''
+    pending = deque()
+    for leftRow, rightRow in pairs:
+        rows, leftPos = np.unique(plan["left"][leftRow], return_inverse=True)
+        future = pool["executor"].submit(comparePartition, pool["list"], df.iloc[rows], leftPos.astype(np.int32), plan["right"][rightRow], sameCols, exactCols, partialCols)
+        pending.append((future, leftRow, rightRow))
+        if len(pending) >= 2 * pool["workers"]:
+            yield partitionResult(*pending.popleft())
+    while pending:
+        yield partitionResult(*pending.popleft())
+
+
+def partitionResult(future, leftRow, rightRow):
+    '''
+    Function to get the matching pairs of a partition and add its pruning counters and similarity cache statistics to those of the main process
+    '''
+    keep, counters = future.result()
+    for name in pruningCounters:
+        pruningCounters[name] += counters[name]
+    similarityCache["hits"] += counters["hits"]
+    similarityCache["misses"] += counters["misses"]
+    return leftRow[keep], rightRow[keep]
+
+
+def blockedMatchesPDM(index, df, lst, lstIndex, exactCols, partialCols, options={}, pool=None):
+    '''
+    Function to get the potential matches of a PDM rule from the blocking key hashes of the list (lstIndex), same as recordMatchesPDM of all the record pairs with the same blocking keys.
+    The candidates are counted first and then materialized and compared in chunks within candidateMemory, only the matching pairs are kept.
+    With a sorted-neighbourhood window the last blocking key is not compared.
+    With a process pool (pool: executor, list name and number of workers) the chunks are partitions of at least partitionPairs pairs compared by the workers
+    '''
+    plan = blockingPlan(index, df, lst, lstIndex, options)
+    sameCols = index[:-1] if "window" in options else index
+    report = candidateReport(plan)
+    # Exact match columns which are blocking keys are already equal (sameKeys), the partial matches are ordered on a sample of the candidates
+    compareCols = [col for col in exactCols if col not in sameCols]
+    leftRow, rightRow = pairRows(plan, np.unique(np.linspace(0, report["pairs"] - 1, min(2000, report["pairs"])).astype(np.int64)))
+    leftPos, rightPos = plan["left"][leftRow], plan["right"][rightRow]
+    keep = sameKeys(df, lst, sameCols, leftPos, rightPos, blockingValues)
+    partialOrder = comparisonOrder(df, lst, leftPos[keep], rightPos[keep], compareCols, partialCols)
+    # Positions (int32) and gathered values of the compared columns of every pair of a chunk
+    chunkSize = max(1, candidateMemory // (48 + 16 * len(set(index + exactCols + partialCols))))
+    if pool is not None and report["pairs"] > partitionPairs:
+        # Enough partitions for all the workers
+        chunkSize = min(chunkSize, max(partitionPairs, -(-report["pairs"] // pool["workers"])))
+    else:
+        pool = None
+    chunks = [(first, min(first + chunkSize, report["pairs"])) for first in range(0, report["pairs"], chunkSize)]
+    print("Candidates: " + str(report["pairs"]) + " pairs in " + str(report["blocks"]) + " blocks (largest block " + str(report["largestBlock"]) + " pairs), compared in " + str(len(chunks)) + (" partitions" if pool is not None else " chunks"))
+    pairs = (candidatePairs(plan, first, last) for first, last in chunks)
+    leftRows = [np.empty(0, dtype=np.int32)]
+    rightRows = [np.empty(0, dtype=np.int32)]
+    if pool is None:
+        for leftRow, rightRow in pairs:
+            keep = compareChunk(df, lst, plan["left"][leftRow], plan["right"][rightRow], sameCols, compareCols, partialOrder)
+            leftRows.append(leftRow[keep])
+            rightRows.append(rightRow[keep])
+    else:
+        cols = list(dict.fromkeys([col if col in df else phoneticKeys[col] for col in sameCols] + compareCols + partialOrder))
+        for leftRow, rightRow in partitionResults(pool, df[cols], pairs, plan, sameCols, compareCols, partialOrder):
+            leftRows.append(leftRow)
+            rightRows.append(rightRow)
+    leftRow, rightRow = np.concatenate(leftRows), np.concatenate(rightRows)
+    # Matches in the order of the blocking keys (first appearance in the customers), then customer, then list record
+    keyOrder = pd.factorize(plan["leftHash"])[0]
+    order = np.lexsort((rightRow, leftRow, keyOrder[leftRow]))
+    names = [df.index.name + "_1", lst.index.name + "_2"] if df.index.name is not None and df.index.name == lst.index.name else [df.index.name, lst.index.name]
+    candidates = pd.MultiIndex(levels=[df.index.values, lst.index.values], codes=[plan["left"][leftRow[order]], plan["right"][rightRow[order]]], names=names, verify_integrity=False)
+    return potentialMatches(candidates, exactCols, partialCols)
+
+
+def colMatchPDMPOS(cust, pos, index, exact, partial, i, score, posIndex=None, candidates=None, options={}, pool=None, scores=None):
     '''
     Function to match customers with the positive list based on a condition
+    With scores (scoreMatches of RecordLinkageScore.py and the scoring frames of the customers and the list) the record based score of every match is added as NEW_SCORE
     '''
-    pos_candidates = indexBlocker(index, cust, pos)
-    pos_matches = recordMatchesPDM(pos_candidates, cust, pos, exact, partial)
+    if candidates is None:
+        pos_matches = blockedMatchesPDM(index, cust, pos, posIndex, exact, partial, options, pool)
+    else:
+        pos_matches = recordMatchesPDM(candidates, cust, pos, exact, partial)
     pos_matches = pos_matches.rename(columns = {'ID_1':'ID_CUST', 'ID_2': 'ID_POS'})
     pos_matches = pos_matches[['ID_CUST', 'ID_POS']]
     matchCriteria = "PDM RULE" + str(i) + ": Exact Matches on [" + ', '.join(exact) + '] AND Partial Matches on [' + ', '.join(partial) + ']'
     pos_matches["MATCH_CRITERIA"] = matchCriteria
     pos_matches["MATCH_SCORE"] = float(score[0])
-    matched_index = pos_matches[["ID_CUST", "ID_POS", "MATCH_CRITERIA", "MATCH_SCORE"]]
+    if scores is not None:
+        scoreMatches, custScores, listScores = scores
+        pos_matches["NEW_SCORE"] = scoreMatches(pos_matches["ID_CUST"].to_numpy(), pos_matches["ID_POS"].to_numpy(), custScores, listScores)
+    matched_index = pos_matches[["ID_CUST", "ID_POS", "MATCH_CRITERIA", "MATCH_SCORE"] + (["NEW_SCORE"] if scores is not None else [])]
     matched_index.sort_values(by=["ID_CUST"], inplace=True)
     matched_index = matched_index.reset_index()
     matched_index = matched_index.drop("index", axis = 1)
@@ -150,18 +708,24 @@ def colMatchPDMPOS(cust, pos, index, exact, partial, i, score):
     cust.set_index("ID", inplace = True)
     return matched_index, cust
 
-def colMatchPDMNEG(cust, neg, index, exact, partial, i, score):
+def colMatchPDMNEG(cust, neg, index, exact, partial, i, score, negIndex=None, candidates=None, options={}, pool=None, scores=None):
     '''
     Function to match customer with the negative list based on a condition
+    With scores (scoreMatches of RecordLinkageScore.py and the scoring frames of the customers and the list) the record based score of every match is added as NEW_SCORE
     '''
-    neg_candidates = indexBlocker(index, cust, neg)
-    neg_matches = recordMatchesPDM(neg_candidates, cust, neg, exact, partial)
+    if candidates is None:
+        neg_matches = blockedMatchesPDM(index, cust, neg, negIndex, exact, partial, options, pool)
+    else:
+        neg_matches = recordMatchesPDM(candidates, cust, neg, exact, partial)
     neg_matches = neg_matches.rename(columns = {'ID_1':'ID_CUST', 'ID_2': 'ID_NEG'})
     neg_matches = neg_matches[['ID_CUST', 'ID_NEG']]
     matchCriteria = "PDM RULE" + str(i) + ": Exact Matches on [" + ', '.join(exact) + '] AND Partial Matches on [' + ', '.join(partial) + ']'
     neg_matches["MATCH_CRITERIA"] = matchCriteria
     neg_matches["MATCH_SCORE"] = float(score[0])
-    matched_index = neg_matches[["ID_CUST", "ID_NEG", "MATCH_CRITERIA", "MATCH_SCORE"]]
+    if scores is not None:
+        scoreMatches, custScores, listScores = scores
+        neg_matches["NEW_SCORE"] = scoreMatches(neg_matches["ID_CUST"].to_numpy(), neg_matches["ID_NEG"].to_numpy(), custScores, listScores)
+    matched_index = neg_matches[["ID_CUST", "ID_NEG", "MATCH_CRITERIA", "MATCH_SCORE"] + (["NEW_SCORE"] if scores is not None else [])]
     matched_index.sort_values(by=["ID_CUST"], inplace=True)
     matched_index = matched_index.reset_index()
     matched_index = matched_index.drop("index", axis = 1)
@@ -172,19 +736,58 @@ def colMatchPDMNEG(cust, neg, index, exact, partial, i, score):
     return matched_index, cust
 
 
-def PDM(cust_df, neg_df, pos_df):
+def pdmStream(cust, lst, conditions, colMatch, listName, intFileDir, fileFormat="csv", lstIndex=None, pool=None, scores=None):
     '''
-    Function to iterativly perform PDM for all the defined rules
+    Function to perform PDM of the customers with one list (colMatchPDMPOS or colMatchPDMNEG) for all the rules and to write the matched files of every rule (with NEW_SCORE, if scores are given).
+    The streams of the positive and the negative list are independent of each other, the candidates of a rule are compared in the process pool (see blockedMatchesPDM) if given
+    '''
+    custFile = r"00_List_Customer_Monitoring.csv"
+    idxs = []
+    i = 1
+    for condition in conditions:
+        index, exactCols, partialCols, matchScore = condition[:4]
+        print("Start of " + listName + " Rule" + str(i) + ':-')
+        print("Exact Match: [" + ', '.join(exactCols) + "]")
+        print('Partial Match: [' + ', '.join(partialCols) + "]")
+        FileName = "PDM_" + listName + "_Rule" + str(i) + ".csv"
+        custFilePostMatch = "PDM_" + listName + "_Rule" + str(i) + "_" + custFile
+        idx, cust = colMatch(cust, lst, index, exactCols, partialCols, i, matchScore, lstIndex, options=blockingOptions(condition), pool=pool, scores=scores)
+        MatchedFiles(intFileDir, FileName, idx, fileFormat)
+        MatchedFiles(intFileDir, custFilePostMatch, cust, fileFormat)
+        idxs.append(idx)
+        print("End of " + listName + " Rule" + str(i) + '!!!')
+        i += 1
+    print("Pruning after " + listName + ": " + str(pruningCounters["pairs"]) + " pairs, removed " + ', '.join(str(pruningCounters[name]) + " " + name for name in ["missing", "equal", "length", "prefix", "histogram"]) + ", " + str(pruningCounters["compared"]) + " compared")
+    stats = cacheStatistics()
+    print("Similarity cache after " + listName + ": " + str(stats["hits"]) + " hits, " + str(stats["misses"]) + " misses (hit rate " + str(round(100 * stats["hitRate"], 1)) + "%), " + str(stats["size"]) + " pairs")
+    return idxs
+
+
+def watchList(dir, file, indexDir, fileFormat="csv"):
+    '''
+    Function to get a negative or positive list with the blocking key hashes of all its columns.
+    Both are read from the watch-list index and only rebuilt when the list file changed
+    '''
+    filename = dir + file if fileFormat == "csv" else columnarFile(dir + file, fileFormat)
+    fingerprint = fileFingerprint(filename)
+    watched = loadWatchList(indexDir, file, fingerprint)
+    if watched is not None:
+        print("Loaded from the watch-list index")
+        df, index = watched
+        # The blocking index is aligned with the records of the list
+        index.index = df.index
+        return df, index
+    df = extractSource(dir, file, fileFormat=fileFormat)
+    index = blockingIndex(df, df.columns)
+    saveWatchList(indexDir, file, fingerprint, df, index)
+    return df, index
+
+
+def pdmConditions():
+    '''
+    Function to get the PDM rules in order of priority, every rule is a list of the blocking columns, the exact match columns, the partial match columns and the rule based matching score
+    The blocking columns may include phonetic keys (phoneticKeys), a rule may have blocking options (see blockingOptions) as fifth element
     '''
-    cust_df = combineName(cust_df)
-    cust_df = combineAddress(cust_df)
-    neg_df = combineName(neg_df)
-    neg_df = combineAddress(neg_df)
-    pos_df = combineName(pos_df)
-    pos_df = combineAddress(pos_df)
-    cust_pos_df = cust_df.copy()
-    cust_neg_df = cust_df.copy()
-    print("Start PDM")
     condition1 = [['FIRST_NAME', 'LAST_NAME', 'CITY'], ['FIRST_NAME', 'LAST_NAME', 'CITY', 'STREET'], ['ZIP'], [81.5]]
     condition2 = [['LAST_NAME', 'CITY', 'ZIP'], ['LAST_NAME', 'CITY', 'ZIP', 'STREET'], ['FIRST_NAME'], [81]]
     condition3 = [['FIRST_NAME', 'CITY', 'ZIP'], ['FIRST_NAME', 'CITY', 'ZIP', 'STREET'], ['LAST_NAME'], [80.5]]
@@ -197,31 +800,163 @@ def PDM(cust_df, neg_df, pos_df):
     condition10 = [['CITY', 'ZIP'], ['CITY', 'ZIP'], ['FIRST_NAME', 'LAST_NAME', 'STREET', 'HNRNEW'], [74]]
     condition11 = [['ZIP'], ['ZIP'], ['FIRST_NAME', 'LAST_NAME', 'CITY', 'STREET', 'HNRNEW'], [73]]
     matchConditions = [condition1, condition2, condition3, condition4, condition5, condition6, condition7, condition8, condition9, condition10, condition11]
+    return matchConditions
+
+
+def customerIndex(cust_df, conditions):
+    '''
+    Function to create the customer index of the reverse mode, the customers with combined name and address and for every PDM rule
+    the sorted blocking key hashes of the customers with their positions and whether the blocking key of a customer is complete
+    '''
+    cust = phoneticColumns(combineAddress(combineName(cust_df.copy())), conditions)
+    blockCols = list(dict.fromkeys(col for condition in conditions for col in condition[0]))
+    custIndex = blockingIndex(cust, blockCols)
+    hashes = np.empty((len(conditions), len(cust)), dtype=np.uint64)
+    positions = np.empty((len(conditions), len(cust)), dtype=np.int64)
+    valid = np.empty((len(conditions), len(cust)), dtype=bool)
+    for r, condition in enumerate(conditions):
+        h = keyHash(custIndex, condition[0])
+        positions[r] = np.argsort(h, kind="stable")
+        hashes[r] = h[positions[r]]
+        valid[r] = blockingFrame(cust, condition[0]).notna().all(axis=1).to_numpy()
+    return cust, {"hashes": hashes, "positions": positions, "valid": valid}
+
+
+def reverseCandidates(cust, lst, index, hashes, positions, valid, lstIndex, matched):
+    '''
+    Function to create the candidates of a few list records from the customer index of a rule (hashes, positions and valid), without the customers in matched.
+    The candidates are the same pairs in the same order as blockedMatchesPDM of the customers which are not matched with these list records
+    '''
+    lstHash = keyHash(keyIndex(lst, lstIndex, index), index)
+    custPos, lstPos = probeIndex(hashes, positions, lstHash)
+    keep = valid[custPos] & ~matched[custPos] & blockingFrame(lst, index).notna().all(axis=1).to_numpy()[lstPos]
+    custPos, lstPos = custPos[keep], lstPos[keep]
+    keep = sameKeys(cust, lst, index, custPos, lstPos, blockingValues)
+    custPos, lstPos = mergeOrder(lstHash[lstPos[keep]], custPos[keep], lstPos[keep])
+    names = [cust.index.name + "_1", lst.index.name + "_2"] if cust.index.name is not None and cust.index.name == lst.index.name else [cust.index.name, lst.index.name]
+    candidates = pd.MultiIndex(levels=[cust.index.values, lst.index.values], codes=[custPos, lstPos], names=names, verify_integrity=False)
+    return candidates
+
+
+def reverseScreening(cwd, fileFormat="csv"):
+    '''
+    Function to match only the records of the negative and positive list which are new or changed since the customers of the customer index were screened against them.
+    The customers are not loaded again, the matches are written to PDM_REVERSE.csv.
+    The customers matched by the reverse mode of DDM (DDM_REVERSE.csv) are not matched, same as the customers matched by DDM in a normal run
+    '''
+    ddmDir = cwd + r"\\IntermediateFiles\\DDM\\"
+    intFileDir = cwd + r"\\IntermediateFiles\\PDM\\"
+    customers = loadCustomerIndex(intFileDir + "CI_PDM", ["hashes", "positions", "valid"])
+    if customers is None:
+        raise FileNotFoundError("No customer index in " + intFileDir + ", run the script once with reverseIndex and without the reverse mode")
+    cust, (hashes, positions, valid), screened = customers
+    ddmFile = ddmDir + datetime.now().strftime("%Y%m%d") + "_DDM_REVERSE.csv"
+    if fileFormat == "csv":
+        ddmMatches = pd.read_csv(ddmFile, usecols=["ID_CUST"])
+    else:
+        ddmMatches = readColumnar(ddmFile, fileFormat, indexCol=None)
+    ddmMatched = cust.index.isin(ddmMatches["ID_CUST"])
+    matchConditions = pdmConditions()
+    idx = {}
+    for file, listName, colMatch in [(r"01a_List_Negative.csv", "NEG", colMatchPDMNEG), (r"01b_List_Positive.csv", "POS", colMatchPDMPOS)]:
+        print(file)
+        df, lstIndex = watchList(ddmDir, file, intFileDir, fileFormat)
+        listHashes = recordHashes(df)
+        changed = changedRecords(listHashes, screened[listName])
+        print(str(len(changed)) + " new or changed records")
+        df = phoneticColumns(combineAddress(combineName(df)), matchConditions)
+        lst = df.iloc[changed]
+        lstIndex = lstIndex.iloc[changed]
+        matched = ddmMatched.copy()
+        idx[listName] = []
+        i = 1
+        for condition in matchConditions:
+            index, exactCols, partialCols, matchScore = condition[:4]
+            options = blockingOptions(condition)
+            if not options:
+                candidates = reverseCandidates(cust, lst, index, hashes[i - 1], positions[i - 1], valid[i - 1], lstIndex, matched)
+                matched_index = colMatch(cust, lst, index, exactCols, partialCols, i, matchScore, candidates=candidates)[0]
+            else:
+                # The sorted-neighbourhood and n-gram blocking need the unmatched customers, not only those with the same blocking key hash
+                matched_index = colMatch(cust[~matched], lst, index, exactCols, partialCols, i, matchScore, lstIndex, options=options)[0]
+            matched |= cust.index.isin(matched_index["ID_CUST"])
+            idx[listName].append(matched_index)
+            i += 1
+        IntermediateFiles(intFileDir, file, df, fileFormat)
+        screened[listName] = listHashes
+    # The customers are now screened against this version of the lists, the next reverse run only matches the records changed after it
+    pd.to_pickle(screened, intFileDir + "CI_PDM_lists.pkl")
+    matched_idx = []
+    i = 1
+    for index, exactCols, partialCols, matchScore in (condition[:4] for condition in matchConditions):
+        matchCriteria = "RULE" + str(i) + ": Exact Matches on [" + ', '.join(exactCols) + '] AND Partial Matches on [' + ', '.join(partialCols) + ']'
+        matched_idx.append(matchedIndex(idx["NEG"][i - 1], idx["POS"][i - 1], matchCriteria))
+        i += 1
+    matched_idx = pd.concat(matched_idx, ignore_index=True, sort=False)
+    matched_idx = matched_idx.sort_values(by=["ID_CUST"], kind="stable").reset_index(drop=True)
+    MatchedFiles(intFileDir, "PDM_REVERSE.csv", matched_idx, fileFormat)
+    return matched_idx
+
+
+def PDM(cust_df, neg_df, pos_df, fileFormat="csv", workers=1, negIndex=None, posIndex=None, unchanged=None, previousMatches=None, score=False):
+    '''
+    Function to iterativly perform PDM for all the defined rules
+    (with workers > 1 the candidates of the rules are compared in partitions in a process pool of workers processes, with the same result)
+    negIndex and posIndex are the blocking key hashes of the lists from the watch-list index, they are computed if not given
+    In delta mode only the customers which are not in unchanged are matched, the matches of the unchanged customers are taken from previousMatches
+    With score the record based score of every match (same as 04_RecordLinkagePDMScore.py) is computed from the records in memory and added as NEW_SCORE
+    (the sentinel values of DDM are read as missing values, so a preprocessed value equal to a sentinel value is scored as missing)
+    '''
+    pdmScore = importlib.import_module(scoreModule) if score else None
+    scores = {listName: pdmScore.scoringFrame(df) for listName, df in [("CUST", cust_df), ("NEG", neg_df), ("POS", pos_df)]} if score else None
+    cust_df = combineName(cust_df)
+    cust_df = combineAddress(cust_df)
+    neg_df = combineName(neg_df)
+    neg_df = combineAddress(neg_df)
+    pos_df = combineName(pos_df)
+    pos_df = combineAddress(pos_df)
+    # Phonetic blocking keys are coded once, not by every blocking step of the rules
+    for df in [cust_df, neg_df, pos_df]:
+        phoneticColumns(df, pdmConditions())
+    if unchanged is None:
+        cust_pos_df = cust_df.copy()
+    else:
+        cust_pos_df = cust_df[~cust_df.index.isin(unchanged)].copy()
+    cust_neg_df = cust_pos_df.copy()
+    print("Start PDM")
+    matchConditions = pdmConditions()
     cwd = os.getcwd()
     intFileDir = cwd + r"\\IntermediateFiles\\PDM\\"
+    # Hash of every blocking column used by the rules, computed once per list record
+    blockCols = list(dict.fromkeys(col for matchCondition in matchConditions for col in matchCondition[0]))
+    if negIndex is None:
+        negIndex = blockingIndex(neg_df, blockCols)
+    if posIndex is None:
+        posIndex = blockingIndex(pos_df, blockCols)
+    streams = [(cust_pos_df, pos_df, posIndex, colMatchPDMPOS, "POS"), (cust_neg_df, neg_df, negIndex, colMatchPDMNEG, "NEG")]
+    streamScores = {listName: None if scores is None else (pdmScore.scoreMatches, scores["CUST"], scores[listName]) for listName in ["POS", "NEG"]}
+    if workers > 1:
+        # The workers get the lists once, the partitions only carry the customers
+        with ProcessPoolExecutor(max_workers=workers, initializer=initPartitions, initargs=({"POS": pos_df, "NEG": neg_df},)) as executor:
+            idxPOS, idxNEG = [pdmStream(cust, lst, matchConditions, colMatch, listName, intFileDir, fileFormat, lstIndex, {"executor": executor, "list": listName, "workers": workers}, streamScores[listName]) for cust, lst, lstIndex, colMatch, listName in streams]
+    else:
+        idxPOS, idxNEG = [pdmStream(cust, lst, matchConditions, colMatch, listName, intFileDir, fileFormat, lstIndex, scores=streamScores[listName]) for cust, lst, lstIndex, colMatch, listName in streams]
     i = 1
-    custFile = r"00_List_Customer_Monitoring.csv"
     matched_idx = pd.DataFrame()
-    for index, exactCols, partialCols, matchScore in matchConditions:
-        print("Start of Rule" + str(i) + ':-')
-        print("Exact Match: [" + ', '.join(exactCols) + "]")
-        print('Partial Match: [' + ', '.join(partialCols) + "]")
-        FileNamePOS = "PDM_POS_Rule" + str(i) + ".csv"
-        FileNameNEG = "PDM_NEG_Rule" + str(i) + ".csv"
-        custFilePOSPostMatch = "PDM_POS_Rule" + str(i) + "_" + custFile
-        custFileNEGPostMatch = "PDM_NEG_Rule" + str(i) + "_" + custFile
+    for index, exactCols, partialCols, matchScore in (condition[:4] for condition in matchConditions):
         matchCriteria = "RULE" + str(i) + ": Exact Matches on [" + ', '.join(exactCols) + '] AND Partial Matches on [' + ', '.join(partialCols) + ']'
-        idxPOS, cust_pos_df = colMatchPDMPOS(cust_pos_df, pos_df, index, exactCols, partialCols, i, matchScore)
-        idxNEG, cust_neg_df = colMatchPDMNEG(cust_neg_df, neg_df, index, exactCols, partialCols, i, matchScore)
-        MatchedFiles(intFileDir, FileNamePOS, idxPOS)
-        MatchedFiles(intFileDir, custFilePOSPostMatch, cust_pos_df)
-        MatchedFiles(intFileDir, FileNameNEG, idxNEG)
-        MatchedFiles(intFileDir, custFileNEGPostMatch, cust_neg_df)
-        matched_idx = matched_idx.append(matchedIndex(idxNEG, idxPOS, matchCriteria), ignore_index=True, sort=False)
+        matched_idx = matched_idx.append(matchedIndex(idxNEG[i - 1], idxPOS[i - 1], matchCriteria), ignore_index=True, sort=False)
         matched_idx.sort_values(by=["ID_CUST"], inplace=True)
-        print("End of Rule" + str(i) + '!!!')
         i += 1
-    matched_idx.sort_values(by=["ID_CUST"], inplace=True)
+    if unchanged is None:
+        matched_idx.sort_values(by=["ID_CUST"], inplace=True)
+    else:
+        # The carried matches are scored again, the previous run may have been without score
+        previous = previousMatches[previousMatches["ID_CUST"].isin(unchanged)].drop(columns="NEW_SCORE", errors="ignore").reset_index(drop=True)
+        if scores is not None:
+            previous = pdmScore.MatchScore(previous, scores["CUST"], scores["POS"], scores["NEG"])
+        matched_idx = matched_idx.append(previous, ignore_index=True, sort=False)
+        matched_idx.sort_values(by=["ID_CUST"], kind="stable", inplace=True)
     matched_idx = matched_idx.reset_index()
     matched_idx = matched_idx.drop("index", axis = 1)
     cust_df = cust_df.reset_index()
@@ -236,29 +971,64 @@ def PDM(cust_df, neg_df, pos_df):
 if __name__ == "__main__":
     print("Data Load started: " + str(datetime.now()))
     cwd = os.getcwd()
-    intFileDir = cwd + r"\\IntermediateFiles\\DDM\\"
-    print("CUSTOMER MONITORING LIST")
-    custFile = r"00_List_Customer_Monitoring.csv"
-    df_cust = extractSource(intFileDir, custFile)
-    print("NEGATIVE LIST")
-    negFile = r"01a_List_Negative.csv"
-    df_neg = extractSource(intFileDir, negFile)
-    print("POSITIVE LIST")
-    posFile = r"01b_List_Positive.csv"
-    df_pos = extractSource(intFileDir, posFile)
-    print("Data Load Completed!!! " + str(datetime.now()))
-    print(len(df_cust), len(df_neg), len(df_pos))
-    print("Probablistic Data Match started: " + str(datetime.now()))
-    index_df, df_cust = PDM(df_cust, df_neg, df_pos)
-    print("Probablistic Data Match completed!!! " + str(datetime.now()))
-    print(len(df_cust), len(df_neg), len(df_pos))
-    print("Data load of PDM file started: " + str(datetime.now()))
-    intFileDir = cwd + r"\\IntermediateFiles\\PDM\\"
-    DDMFile = r"PDM.csv"
-    peCustFile = "PDM_" + custFile
-    MatchedFiles(intFileDir, DDMFile, index_df)
-    IntermediateFiles(intFileDir, peCustFile, df_cust)
-    IntermediateFiles(intFileDir, custFile, df_cust)
-    IntermediateFiles(intFileDir, negFile, df_neg)
-    IntermediateFiles(intFileDir, posFile, df_pos)
-    print("Data load of PDM file completed!!! " + str(datetime.now()))
+    # Format of the intermediate files shared between the scripts ("csv", "parquet" or "feather"), must be the same in all the scripts
+    fileFormat = "csv"
+    # Reverse mode: after an update of the lists only their new or changed records are matched against the customer index of the previous run
+    reverse = False
+    # Customer index for the reverse mode, written by a normal run only if the reverse mode is used afterwards
+    reverseIndex = False
+    if reverse:
+        print("Reverse Data Match started: " + str(datetime.now()))
+        index_df = reverseScreening(cwd, fileFormat)
+        print(len(index_df))
+        print("Reverse Data Match completed!!! " + str(datetime.now()))
+    else:
+        intFileDir = cwd + r"\\IntermediateFiles\\DDM\\"
+        print("CUSTOMER MONITORING LIST")
+        custFile = r"00_List_Customer_Monitoring.csv"
+        df_cust = extractSource(intFileDir, custFile, fileFormat=fileFormat)
+        # Negative and positive list are loaded with their blocking key hashes from the watch-list index, which is only rebuilt when the list changed
+        indexDir = cwd + r"\\IntermediateFiles\\PDM\\"
+        print("NEGATIVE LIST")
+        negFile = r"01a_List_Negative.csv"
+        df_neg, negIndex = watchList(intFileDir, negFile, indexDir, fileFormat)
+        print("POSITIVE LIST")
+        posFile = r"01b_List_Positive.csv"
+        df_pos, posIndex = watchList(intFileDir, posFile, indexDir, fileFormat)
+        print("Data Load Completed!!! " + str(datetime.now()))
+        print(len(df_cust), len(df_neg), len(df_pos))
+        print("Probablistic Data Match started: " + str(datetime.now()))
+        # Number of processes comparing the candidate pairs of the PDM rules (1 = all in this process)
+        workers = os.cpu_count()
+        # Record based score of the matches computed during PDM and written to PDM1.csv, 04_RecordLinkagePDMScore.py is then only needed for backfills
+        score = False
+        # Delta mode: the results of the customers which are unchanged since the previous run are carried over (see 01_RecordLinkageDDM.py)
+        delta = loadState(cwd + r"\\IntermediateFiles\\Preprocessed\\Delta.pkl")
+        stateFile = cwd + r"\\IntermediateFiles\\PDM\\Delta_PDM.pkl"
+        state = loadState(stateFile)
+        rules = ruleFingerprint(pdmConditions(), partialThreshold)
+        unchanged = carriedCustomers(delta, state, rules)
+        if reverseIndex:
+            # Customer index for the reverse mode, keyed by the blocking key of every PDM rule, with the versions of the lists screened by this run
+            saveCustomerIndex(indexDir + "CI_PDM", *customerIndex(df_cust, pdmConditions()), {"NEG": recordHashes(df_neg), "POS": recordHashes(df_pos)})
+        if unchanged is None:
+            index_df, df_cust = PDM(df_cust, df_neg, df_pos, fileFormat, workers, negIndex, posIndex, score=score)
+        else:
+            index_df, df_cust = PDM(df_cust, df_neg, df_pos, fileFormat, workers, negIndex, posIndex, unchanged, state["matches"], score)
+        if delta is not None:
+            saveState(stateFile, delta, rules, index_df)
+        print("Probablistic Data Match completed!!! " + str(datetime.now()))
+        print(len(df_cust), len(df_neg), len(df_pos))
+        print("Data load of PDM file started: " + str(datetime.now()))
+        intFileDir = cwd + r"\\IntermediateFiles\\PDM\\"
+        DDMFile = r"PDM.csv"
+        peCustFile = "PDM_" + custFile
+        MatchedFiles(intFileDir, DDMFile, index_df, fileFormat)
+        if score:
+            # Same file as written by 04_RecordLinkagePDMScore.py (always csv)
+            MatchedFiles(intFileDir, r"PDM1.csv", index_df)
+        IntermediateFiles(intFileDir, peCustFile, df_cust, fileFormat)
+        IntermediateFiles(intFileDir, custFile, df_cust, fileFormat)
+        IntermediateFiles(intFileDir, negFile, df_neg, fileFormat)
+        IntermediateFiles(intFileDir, posFile, df_pos, fileFormat)
+        print("Data load of PDM file completed!!! " + str(datetime.now()))
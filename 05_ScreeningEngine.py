@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+
+## IMPORTANT: FOLDER STRUCTURE ##
+Below mentioned folder structure must be followed for getting the results from this script:
+01. Script must be placed into the main folder, next to the scripts 01_RecordLinkageDDM.py to 04_RecordLinkagePDMScore.py, RecordLinkageCommon.py and RecordLinkageScore.py
+02. Source files (3 lists) must be placed into the Source folder under main folder
+03. a folder named as IntermediateFiles must be created under main folder with below mentioned sub-folders
+    A. Source
+    B. Preprocessed
+    C. IntermediateFiles
+        i.  DDM
+        ii. PDM
+
+## IMPORTANT: EXECUTION ORDER ##
+01_RecordLinkageDDM.py must have been executed once, this script reads the negative and positive list from its watch-list index.
+
+This script provides a long-lived screening engine for single customer records (e.g. at onboarding time). It performs below mentioned steps:
+01. Loads the preprocessed negative and positive list once and keeps them in memory together with the key hashes of all the DDM and PDM rules
+02. Preprocesses an incoming customer record with dataPreprocessing
+03. Matches the record using the DDM rules and, if there is no DDM match, using the PDM rules
+04. Generates the record based score of every match with scoreMatches
+The rules, the preprocessing and the scoring are taken from the batch scripts, so that batch and online results agree.
+The engine is used from python (loadEngine and screenRecord) or through a local HTTP endpoint (serveEngine)
+
+"""
+
+# Load required packages
+import os
+import json
+import importlib
+import traceback
+import pandas as pd
+import numpy as np
+from datetime import datetime
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from RecordLinkageCommon import defaultNaValues, sentinelValues, keyHash, probeIndex
+from RecordLinkageScore import scoringFrame, MatchScore
+
+# Batch scripts providing the rules and the preprocessing
+ddm = importlib.import_module("01_RecordLinkageDDM")
+pdm = importlib.import_module("02_RecordLinkagePDM")
+
+# Columns of a customer record, same as in the source file of the customer list
+recordColumns = ["ID", "FIRST_NAME", "LAST_NAME", "DOB", "STREET", "HNR", "HNRADD", "ZIP", "CITY"]
+# Columns of the matches, same as in DDM1.csv and PDM1.csv
+matchColumns = ["ID_CUST", "ID_NEG", "ID_POS", "MATCH_CRITERIA", "MATCH_SCORE", "NEW_SCORE"]
+
+
+def readRecord(record):
+    '''
+    Function to read a customer record (dict with the columns of the customer list) into a dataframe with the same values and types as a row of the source file read by extractSource
+    A record without ID gets the ID 0
+    '''
+    naValues = set(defaultNaValues + ["0000-00-00"])
+    values = {}
+    for col in recordColumns[1:]:
+        value = record.get(col)
+        values[col] = np.array([np.nan if value is None or str(value) in naValues else str(value)], dtype=object)
+    # A DOB which is not a date is kept as text, same as by the pandas reader
+    try:
+        values["DOB"] = [pd.Timestamp(values["DOB"][0])]
+    except ValueError:
+        pass
+    df = pd.DataFrame(values, index=pd.Index([pd.to_numeric(record.get("ID", 0), errors="ignore")], name="ID"))
+    return df
+
+
+def asRead(df, naValues):
+    '''
+    Function to replace the values which become missing when the batch scripts write the records to an intermediate file and read them again.
+    All the columns but DOB are read as text, also if they have no value
+    '''
+    df = df.copy()
+    for col in df.columns.drop("DOB"):
+        df[col] = df[col].astype(object).where(~df[col].isin(defaultNaValues + naValues), np.nan)
+    return df
+
+
+def pdmFrame(df):
+    '''
+    Function to bring preprocessed records into the form in which 02_RecordLinkagePDM.py reads them from the DDM files (DOB as date)
+    '''
+    df = asRead(df, sentinelValues)
+    df['DOB'] = pd.to_datetime(df['DOB'], format='%Y-%m-%d')
+    return df
+
+
+def recordValues(df, naValues=[]):
+    '''
+    Function to get the values of a single record as dict, the values in naValues are replaced by NaN (same as asRead)
+    '''
+    naValues = set(naValues)
+    return {col: np.nan if type(value) == str and value in naValues else value for col, value in df.iloc[0].items()}
+
+
+def recordIndex(values, cols):
+    '''
+    Function to compute the hash of every key column of a single record, same as ddmIndex and blockingIndex (0 for a missing value)
+    '''
+    hashes = pd.util.hash_array(np.array([values[col] for col in cols], dtype=object), categorize=False)
+    missing = np.array([pd.isnull(values[col]) for col in cols], dtype=bool)
+    return pd.DataFrame([np.where(missing, np.uint64(0), hashes)], columns=cols)
+
+
+def ruleIndex(index, keys, keyHash, df=None):
+    '''
+    Function to create for every rule (key columns in keys) the sorted key hashes of the list records with their positions.
+    If df is given, the records with a missing key value are left out (they are never PDM candidates)
+    '''
+    hashes = []
+    positions = []
+    for cols in keys:
+        h = keyHash(index, cols)
+        sorter = np.argsort(h, kind="stable")
+        if df is not None:
+            sorter = sorter[df[cols].notna().all(axis=1).to_numpy()[sorter]]
+        hashes.append(h[sorter])
+        positions.append(sorter)
+    return hashes, positions
+
+
+def columnValues(df, cols):
+    '''
+    Function to get the values of the columns as object arrays, compared in the same way as by sameKeys
+    '''
+    return {col: df[col].astype(object).to_numpy() for col in cols}
+
+
+def sameValues(custValues, lstValues, cols, lstPos):
+    '''
+    Function to flag the list records (positions lstPos) whose values of the columns are equal to those of the customer record
+    '''
+    keep = np.ones(len(lstPos), dtype=bool)
+    for col in cols:
+        keep &= lstValues[col][lstPos] == custValues[col]
+    return keep
+
+
+def similarValues(custValues, lstValues, cols, lstPos):
+    '''
+    Function to flag the list records (positions lstPos) whose values of the columns are a partial match of those of the customer record
+    (partialMatches of 02_RecordLinkagePDM.py with partialThreshold, the columns one after another on the records which still match, same as pairMatches)
+    '''
+    keep = np.ones(len(lstPos), dtype=bool)
+    for col in cols:
+        pos = np.flatnonzero(keep)
+        keep[pos] = pdm.partialMatches(np.full(len(pos), custValues[col], dtype=object), lstValues[col][lstPos[pos]], pdm.partialThreshold)
+    return keep
+
+
+def loadEngine(cwd):
+    '''
+    Function to load the screening engine: the negative and positive list from the watch-list index of 01_RecordLinkageDDM.py, in the forms used by DDM, PDM and the scoring,
+    and the sorted key hashes of the lists for every DDM and PDM rule
+    '''
+    srcFolder = cwd + r"\\Source\\"
+    indexDir = cwd + r"\\IntermediateFiles\\Preprocessed\\"
+    ddmConditions = ddm.ddmConditions()
+    pdmConditions = pdm.pdmConditions()
+    keyCols = list(dict.fromkeys(col for condition in ddmConditions for col in condition[:-1]))
+    blockCols = list(dict.fromkeys(col for condition in pdmConditions for col in condition[0]))
+    compareCols = list(dict.fromkeys(col for condition in pdmConditions for col in condition[0] + condition[1] + condition[2]))
+    lists = {}
+    # Criteria of the positive list have no blank between RULE and the rule number
+    for file, listName, rulePrefix in [(r"01a_List_Negative.csv", "NEG", "DDM RULE "), (r"01b_List_Positive.csv", "POS", "DDM RULE")]:
+        print(file)
+        df, index = ddm.watchList(srcFolder, file, listName, indexDir)
+        ddmList = ddm.ddmList(df.copy(), listName)
+        # Names and addresses are combined as in PDM for the n-gram blocking
+        pdmList = pdm.phoneticColumns(pdm.combineAddress(pdm.combineName(pdmFrame(df))), pdmConditions)
+        lists[listName] = {
+            "ddmIDs": ddmList["ID"].to_numpy(),
+            "ddmValues": columnValues(ddmList, keyCols),
+            "ddmIndex": ruleIndex(index, [condition[:-1] for condition in ddmConditions], keyHash),
+            "pdmIDs": pdmList.index.to_numpy(),
+            "pdmValues": columnValues(pdm.blockingFrame(pdmList, compareCols), compareCols),
+            "pdmIndex": ruleIndex(pdm.blockingIndex(pdmList, blockCols), [condition[0] for condition in pdmConditions], keyHash, pdm.blockingFrame(pdmList, blockCols)),
+            # Prepared list records of the rules with blocking options (sorted-neighbourhood or n-gram blocking)
+            "pdmPlans": {r: pdm.listBlocking(condition[0], pdmList, options=pdm.blockingOptions(condition)) for r, condition in enumerate(pdmConditions) if pdm.blockingOptions(condition)},
+            "score": scoringFrame(df),
+            "rulePrefix": rulePrefix,
+        }
+        print(len(df))
+    return {"ddmConditions": ddmConditions, "pdmConditions": pdmConditions, "keyCols": keyCols, "blockCols": blockCols, "compareCols": compareCols, "lists": lists}
+
+
+def ddmMatches(engine, df):
+    '''
+    Function to match a preprocessed customer record with the lists using the DDM rules in order of priority.
+    The record is matched with every list by the first rule with a hit, same as in DDM
+    '''
+    cust = ddm.ddmCustomers(df)
+    custValues = recordValues(cust)
+    custIndex = recordIndex(custValues, engine["keyCols"])
+    custHashes = [keyHash(custIndex, condition[:-1]) for condition in engine["ddmConditions"]]
+    found = []
+    for listName, lst in engine["lists"].items():
+        hashes, positions = lst["ddmIndex"]
+        for r, condition in enumerate(engine["ddmConditions"]):
+            cols = condition[:-1]
+            lstPos = probeIndex(hashes[r], positions[r], custHashes[r])[0]
+            lstPos = lstPos[sameValues(custValues, lst["ddmValues"], cols, lstPos)]
+            if len(lstPos) > 0:
+                matchCriteria = lst["rulePrefix"] + str(r + 1) + ": " + ', '.join(cols)
+                found.append((r, ddm.matchedFrame(np.full(len(lstPos), custValues["ID"]), lst["ddmIDs"][lstPos], "ID_" + listName, matchCriteria, condition[-1])))
+                break
+    return found
+
+
+def pdmMatches(engine, df):
+    '''
+    Function to match a preprocessed customer record with the lists using the PDM rules in order of priority.
+    The candidates of a rule are the list records with the same blocking key (same as blockedMatchesPDM) or those of the blocking options of the rule (same as blockingPlan),
+    the record is matched with every list by the first rule with a match
+    '''
+    custValues = recordValues(df, defaultNaValues + sentinelValues)
+    for col in engine["blockCols"]:
+        if col in pdm.phoneticKeys:
+            custValues[col] = pdm.phoneticCode(custValues[pdm.phoneticKeys[col]])
+    custIndex = recordIndex(custValues, engine["blockCols"])
+    custFrame = None
+    found = []
+    for listName, lst in engine["lists"].items():
+        hashes, positions = lst["pdmIndex"]
+        for r, condition in enumerate(engine["pdmConditions"]):
+            index, exactCols, partialCols, matchScore = condition[:4]
+            # Records with a missing blocking or exact match value are never matched
+            if any(pd.isnull(custValues[col]) for col in index + exactCols):
+                continue
+            if r in lst["pdmPlans"]:
+                if custFrame is None:
+                    # Text columns stay text columns if a value is missing (same as the customers read by PDM)
+                    custFrame = pd.DataFrame([custValues]).astype({col: object for col in ["FIRST_NAME", "LAST_NAME", "HNRNEW", "STREET"]})
+                    custFrame = pdm.combineAddress(pdm.combineName(custFrame))
+                plan = lst["pdmPlans"][r]
+                probe = pdm.probeBlocking(plan, index, custFrame, custIndex)
+                lstPos = plan["right"][probe["sorter"][probe["start"][0]:probe["start"][0] + probe["counts"][0]]] if len(probe["left"]) else np.empty(0, dtype=np.int64)
+                sameCols = index[:-1] + exactCols if "window" in pdm.blockingOptions(condition) else index + exactCols
+            else:
+                lstPos = probeIndex(hashes[r], positions[r], keyHash(custIndex, index))[0]
+                sameCols = index + exactCols
+            lstPos = lstPos[sameValues(custValues, lst["pdmValues"], list(dict.fromkeys(sameCols)), lstPos)]
+            lstPos = lstPos[similarValues(custValues, lst["pdmValues"], partialCols, lstPos)]
+            if len(lstPos) > 0:
+                matchCriteria = "PDM RULE" + str(r + 1) + ": Exact Matches on [" + ', '.join(exactCols) + '] AND Partial Matches on [' + ', '.join(partialCols) + ']'
+                found.append((r, ddm.matchedFrame(np.full(len(lstPos), df.index[0]), lst["pdmIDs"][lstPos], "ID_" + listName, matchCriteria, matchScore[0])))
+                break
+    return found
+
+
+def screenRecord(engine, record):
+    '''
+    Function to screen a single customer record (dict with the columns of the customer list) against the negative and positive list.
+    The record is preprocessed and matched using the DDM rules and, only if there is no DDM match, using the PDM rules (same as the batch scripts).
+    Returns the scored matches with the columns of DDM1.csv and PDM1.csv, the matches of a rule with the negative list before those with the positive list
+    '''
+    if not isinstance(record, dict):
+        raise ValueError("A customer record must be a dict with the columns " + ', '.join(recordColumns))
+    # Values of the columns are read as text (same as from the source file), lists and objects have no such value
+    invalid = [col for col in recordColumns if not isinstance(record.get(col), (str, int, float, type(None)))]
+    if invalid:
+        raise ValueError("The values of a customer record must be text, a number or null: " + ', '.join(invalid))
+    df = ddm.dataPreprocessing(readRecord(record))
+    found = ddmMatches(engine, df)
+    if not found:
+        found = pdmMatches(engine, df)
+    if not found:
+        return pd.DataFrame(columns=matchColumns)
+    found.sort(key=lambda match: match[0])
+    matches = pd.concat([matched_index for r, matched_index in found], ignore_index=True, sort=False)
+    matches = matches.reindex(columns=matchColumns[:-1])
+    lists = engine["lists"]
+    custValues = recordValues(df, defaultNaValues + ["0000-00-00"])
+    if type(custValues["DOB"]) == pd.Timestamp:
+        custValues["DOB"] = custValues["DOB"].strftime("%Y-%m-%d")
+    matches = MatchScore(matches, pd.DataFrame([custValues], index=df.index), lists["POS"]["score"], lists["NEG"]["score"])
+    return matches
+
+
+class ScreeningHandler(BaseHTTPRequestHandler):
+    '''
+    Request handler of the local HTTP endpoint, a POST of a customer record as JSON object returns its matches as JSON list.
+    An invalid request gets the status 400 and any other error the status 500, both with the error as JSON object
+    '''
+    def do_POST(self):
+        try:
+            record = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            body = screenRecord(self.server.engine, record).to_json(orient="records")
+            status = 200
+        except ValueError as e:
+            body = json.dumps({"error": str(e)})
+            status = 400
+        except Exception as e:
+            traceback.print_exc()
+            body = json.dumps({"error": "Internal error: " + str(e)})
+            status = 500
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serveEngine(engine, host="127.0.0.1", port=8765):
+    '''
+    Function to serve the screening engine on a local HTTP endpoint until the script is stopped
+    '''
+    server = HTTPServer((host, port), ScreeningHandler)
+    server.engine = engine
+    print("Screening engine listening on http://" + host + ":" + str(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+# Main function - starting point of the script
+if __name__ == "__main__":
+    print("Engine Load started: " + str(datetime.now()))
+    cwd = os.getcwd()
+    engine = loadEngine(cwd)
+    print("Engine Load Completed!!! " + str(datetime.now()))
+    # Local HTTP endpoint, only reachable from this machine
+    host = "127.0.0.1"
+    port = 8765
+    serveEngine(engine, host, port)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+
+Functions shared by the record linkage scripts 01_RecordLinkageDDM.py to 05_ScreeningEngine.py, must be placed into the main folder next to the scripts:
+01. Reading and writing the source, intermediate and matched files (csv, parquet or feather)
+02. Key hashes of the DDM and PDM rules and the hash joins on them
+03. Watch-list index of the negative and positive list and customer index of the reverse mode
+04. State of the delta mode saved by a run for the next run
+
+"""
+
+# Load required packages
+import os
+import json
+import hashlib
+import pandas as pd
+import numpy as np
+from datetime import datetime
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pacsv
+    from pyarrow import feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Missing value markers of pandas.read_csv, also used by the pyarrow reader to produce the same NaN values
+defaultNaValues = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "n/a", "nan", "null"]
+# Values used in place of the missing values during DDM to avoid invalid matches
+sentinelValues = ['1900-00-00', '1800-00-00', '1700-00-00', '-99999', '-88888', '-77777']
+
+
+def arrowToPandas(table, indexCol="ID"):
+    '''
+    Function to convert a pyarrow table into a dataframe with NaN (instead of None) for the missing string values
+    '''
+    df = table.to_pandas()
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].notna(), np.nan)
+    if indexCol is not None:
+        df = df.set_index(indexCol)
+    return df
+
+
+def readCSV(filename, dtype, indexCol="ID", dates=[], naValues=[], memoryMap=False):
+    '''
+    Function to read a csv file with a multithreaded parser (pyarrow, if installed) applying the declared column types (object, category or date) up front
+    '''
+    if pa is not None:
+        types = {col: pa.dictionary(pa.int32(), pa.string()) if colType == "category" else pa.string() for col, colType in dtype.items()}
+        types.update({col: pa.timestamp("ns") for col in dates})
+        readOptions = pacsv.ReadOptions(use_threads=True)
+        convertOptions = pacsv.ConvertOptions(column_types=types, null_values=defaultNaValues + naValues, strings_can_be_null=True)
+        try:
+            source = pa.memory_map(filename) if memoryMap else filename
+            return arrowToPandas(pacsv.read_csv(source, read_options=readOptions, convert_options=convertOptions), indexCol)
+        except pa.ArrowInvalid:
+            # Values which pyarrow cannot convert (for example invalid dates) are left to pandas
+            pass
+    df = pd.read_csv(filename, index_col=indexCol, na_values=naValues, parse_dates=dates, dtype=dtype, memory_map=memoryMap)
+    return df
+
+
+def columnarFile(filename, fileFormat):
+    '''
+    Function to get the name of the columnar (parquet or feather) file corresponding to a csv file name
+    '''
+    return os.path.splitext(filename)[0] + "." + fileFormat
+
+
+def writeColumnar(filename, df, fileFormat):
+    '''
+    Function to write a dataframe into a columnar (parquet or feather) file, storing the sentinel values used for matching as nulls so that the data types are kept
+    '''
+    df = df.replace(sentinelValues, np.nan)
+    if "DOB" in df.columns and df["DOB"].dtype == object:
+        df["DOB"] = pd.to_datetime(df["DOB"])
+    filename = columnarFile(filename, fileFormat)
+    if fileFormat == "parquet":
+        df.to_parquet(filename, index=False)
+    else:
+        df.to_feather(filename)
+
+
+def readColumnar(filename, fileFormat, indexCol="ID"):
+    '''
+    Function to read a columnar (parquet or feather) file written by the previous scripts using memory mapping
+    '''
+    filename = columnarFile(filename, fileFormat)
+    if fileFormat == "parquet":
+        table = pq.read_table(filename, memory_map=True)
+    else:
+        table = feather.read_table(filename, memory_map=True)
+    return arrowToPandas(table, indexCol)
+
+
+def IntermediateFiles(dir, file, df, fileFormat="csv"):
+    '''
+    Function to create intermediate files post a specific operation like Data Preprocessing with index values
+    '''
+    originalFiles = ["00_List_Customer_Monitoring.csv", "01a_List_Negative.csv", "01b_List_Positive.csv"]
+    if file in originalFiles:
+        file = file
+    else:
+        file = datetime.now().strftime("%Y%m%d") + "_" + file
+    filename = dir + file
+    if fileFormat == "csv":
+        df.to_csv(filename)
+    else:
+        writeColumnar(filename, df.reset_index(), fileFormat)
+
+
+def MatchedFiles(dir, file, df, fileFormat="csv"):
+    '''
+    Function to create intermediate files post a specific operation like Data Preprocessing without index values
+    '''
+    originalFiles = ["00_List_Customer_Monitoring.csv", "01a_List_Negative.csv", "01b_List_Positive.csv"]
+    if file in originalFiles:
+        file = file
+    else:
+        file = datetime.now().strftime("%Y%m%d") + "_" + file
+    filename = dir + file
+    if fileFormat == "csv":
+        df.to_csv(filename, index=False)
+    else:
+        writeColumnar(filename, df.reset_index(drop=True), fileFormat)
+
+
+def matchedIndex(nmatch, pmatch, rule):
+    '''
+    Function to append customers matched with negative list to the customers matched with positive list
+    '''
+    match = nmatch.append(pmatch, ignore_index=True, sort=False)
+    match = match[["ID_CUST", "ID_NEG", "ID_POS", "MATCH_CRITERIA", "MATCH_SCORE"] + (["NEW_SCORE"] if "NEW_SCORE" in match else [])]
+    match.sort_values(by=["ID_CUST"], inplace=True)
+    match = match.reset_index()
+    match = match.drop("index", axis = 1)
+    return match
+
+
+def keyHash(index, cols):
+    '''
+    Function to combine the column hashes of a key index (ddmIndex or blockingIndex) into a single 64-bit hash of the key (cols)
+    '''
+    h = np.zeros(len(index), dtype=np.uint64)
+    for col in cols:
+        h = h * np.uint64(1099511628211) ^ index[col].to_numpy()
+    return h
+
+
+def sameKeys(left, right, cols, leftPos, rightPos, values=None):
+    '''
+    Function to flag the pairs of a hash join whose key values are equal, so that pairs with the same hash but different keys (hash collisions) can be removed.
+    The key values of a column are df[col] or values(df, col) if given
+    '''
+    if values is None:
+        values = lambda df, col: df[col]
+    keep = np.ones(len(leftPos), dtype=bool)
+    for col in cols:
+        keep &= values(left, col).iloc[leftPos].astype(object).to_numpy() == values(right, col).iloc[rightPos].astype(object).to_numpy()
+    return keep
+
+
+def probeIndex(sortedHash, sorter, probeHash):
+    '''
+    Function to find for every probe hash the positions of all the records of a sorted hash index (sortedHash and the record positions sorter) with the same hash
+    '''
+    start = np.searchsorted(sortedHash, probeHash, side="left")
+    counts = np.searchsorted(sortedHash, probeHash, side="right") - start
+    probePos = np.repeat(np.arange(len(probeHash)), counts)
+    offsets = np.arange(len(probePos)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return sorter[np.repeat(start, counts) + offsets], probePos
+
+
+def mergeOrder(keys, leftPos, rightPos):
+    '''
+    Function to sort the pairs of a join in the order of an inner pd.merge, if all the left records of a key are in the pairs
+    (keys in the order of their first appearance in left, then left position, then right position)
+    '''
+    codes = pd.factorize(keys)[0]
+    first = np.full(codes.max() + 1 if len(codes) else 0, np.iinfo(np.int64).max)
+    np.minimum.at(first, codes, leftPos)
+    order = np.lexsort((rightPos, leftPos, first[codes]))
+    return leftPos[order], rightPos[order]
+
+
+def fileFingerprint(filename, *versions):
+    '''
+    Function to compute the fingerprint of a source file together with the given versions (e.g. of the preprocessing) and the pandas version (the key hashes depend on pandas)
+    '''
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return "-".join([sha.hexdigest()] + [str(version) for version in versions] + [pd.__version__])
+
+
+def loadWatchList(indexDir, file, fingerprint):
+    '''
+    Function to load a list and its key hashes (memory mapped, with a range index) from the watch-list index.
+    Returns None if the index is missing or out of date
+    '''
+    filename = indexDir + "WL_" + os.path.splitext(file)[0]
+    try:
+        with open(filename + ".json") as f:
+            meta = json.load(f)
+        if meta["fingerprint"] != fingerprint:
+            return None
+        df = pd.read_pickle(filename + ".pkl")
+        hashes = np.load(filename + ".npy", mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        return None
+    return df, pd.DataFrame(hashes, columns=meta["columns"], copy=False)
+
+
+def saveWatchList(indexDir, file, fingerprint, df, index):
+    '''
+    Function to write a list and its key hashes to the watch-list index.
+    The fingerprint is written last so that an incomplete index is never loaded
+    '''
+    filename = indexDir + "WL_" + os.path.splitext(file)[0]
+    df.to_pickle(filename + ".pkl")
+    np.save(filename + ".npy", index.to_numpy())
+    with open(filename + ".json", "w") as f:
+        json.dump({"fingerprint": fingerprint, "columns": list(index.columns)}, f)
+
+
+def recordHashes(df):
+    '''
+    Function to get the hashes of the records of a list (with their IDs), the customer index keeps them for the version of the list its customers were screened against
+    '''
+    return pd.util.hash_pandas_object(df, index=True).to_numpy()
+
+
+def changedRecords(hashes, screened):
+    '''
+    Function to get the positions of the records of a list (hashes of recordHashes) which are new or changed since the customers of the customer index were screened against the list (record hashes screened)
+    '''
+    return np.flatnonzero(~np.isin(hashes, screened))
+
+
+def saveCustomerIndex(filename, cust, arrays, screened):
+    '''
+    Function to write the customer index of the reverse mode and the record hashes of the lists its customers were screened against (dict of list name and recordHashes), the arrays are loaded memory mapped
+    '''
+    cust.to_pickle(filename + ".pkl")
+    for name, array in arrays.items():
+        np.save(filename + "_" + name + ".npy", array)
+    pd.to_pickle(screened, filename + "_lists.pkl")
+
+
+def loadCustomerIndex(filename, names):
+    '''
+    Function to load the customer index of the reverse mode and the record hashes of the screened lists, returns None if there is no index
+    '''
+    try:
+        cust = pd.read_pickle(filename + ".pkl")
+        arrays = [np.load(filename + "_" + name + ".npy", mmap_mode="r") for name in names]
+        screened = pd.read_pickle(filename + "_lists.pkl")
+    except (OSError, ValueError, EOFError):
+        return None
+    return cust, arrays, screened
+
+
+def loadState(filename):
+    '''
+    Function to load the state saved by the previous run for the delta mode, returns None if there is no previous run
+    '''
+    try:
+        return pd.read_pickle(filename)
+    except (OSError, ValueError, EOFError):
+        return None
+
+
+def ruleFingerprint(*tables):
+    '''
+    Function to compute the fingerprint of the rule tables and thresholds of a script, the results of the previous run are only carried over if it used the same rules
+    '''
+    return hashlib.sha256(json.dumps(tables).encode()).hexdigest()
+
+
+def unchangedCustomers(state, fingerprints, listFingerprints, rules):
+    '''
+    Function to get the IDs of the customers whose normalized record is the same as in the previous run.
+    Returns None if all the customers must be screened (no previous run, changed lists or rules (fingerprint of ruleFingerprint) or IDs which are not unique)
+    '''
+    if state is None or state["lists"] != listFingerprints or state.get("rules") != rules or not fingerprints.index.is_unique or not state["fingerprints"].index.is_unique:
+        return None
+    previous = state["fingerprints"]
+    common = fingerprints.index.intersection(previous.index)
+    return common[fingerprints[common].to_numpy() == previous[common].to_numpy()]
+
+
+def carriedCustomers(delta, state, rules):
+    '''
+    Function to get the IDs of the unchanged customers (unchangedCustomers, found by 01_RecordLinkageDDM.py) whose results of the previous run are carried over.
+    Returns None if all the customers must be screened (the previous run of the calling script is not the base run of the delta or used other rules or weights)
+    '''
+    if delta is None or state is None or delta["base"] is None or state["run"] != delta["base"] or state.get("rules") != rules:
+        return None
+    return delta["unchanged"]
+
+
+def saveState(filename, delta, rules, matches):
+    '''
+    Function to save the results of a run of the scripts after 01_RecordLinkageDDM.py for the delta mode of the next run (delta of the run, fingerprint of ruleFingerprint and the matches)
+    '''
+    pd.to_pickle({"run": delta["run"], "rules": rules, "matches": matches}, filename)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+
+Record based score of the matches, shared by the scripts 03_RecordLinkageDDMScore.py and 04_RecordLinkagePDMScore.py (and the score option of 01_RecordLinkageDDM.py and 02_RecordLinkagePDM.py),
+must be placed into the main folder next to the scripts:
+01. Reads the preprocessed customer, negative and positive list
+02. Scores every match with the similarity of the values of the weighted columns, optionally in a process pool of workers
+
+"""
+
+# Load required packages
+import pandas as pd
+from datetime import datetime
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+try:
+    # Compiled drop-in replacement of difflib, same ratios
+    from cydifflib import SequenceMatcher
+except ImportError:
+    from difflib import SequenceMatcher
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+from RecordLinkageCommon import defaultNaValues, readCSV, readColumnar
+
+
+def extractSource(dir, files, memoryMap=False, fileFormat="csv"):
+    '''
+    Function to extract Data from files in a specific format
+    '''
+    t = {"FIRST_NAME": object, "LAST_NAME": object, "DOB": object, "STREET": object,"ZIP": object, "CITY": object, "HNRNEW": object}
+    files = datetime.now().strftime("%Y%m%d") + "_" + files
+    filename = dir + files
+    if fileFormat != "csv":
+        df = readColumnar(filename, fileFormat)
+        # DOB is compared as text
+        df["DOB"] = df["DOB"].dt.strftime("%Y-%m-%d")
+        return df
+    df = readCSV(filename, t, naValues=["0000-00-00"], memoryMap=memoryMap)
+    return df
+
+# Similarity scores of the value pairs (customer value, list value) scored during a run, the least recently used pairs are evicted above maxSize
+scoreCache = {"pairs": OrderedDict(), "maxSize": 200000, "hits": 0, "misses": 0}
+
+def similarities(left, right, cache=scoreCache):
+    '''
+    Function to get the similarity scores (ratio of the SequenceMatcher) of the value pairs (left[k], right[k]) from the score cache, every distinct pair which is not in the cache is computed once.
+    The missing pairs are grouped by the list value, so that the SequenceMatcher indexes every list value only once
+    '''
+    pairs = cache["pairs"]
+    ratio = np.empty(len(left))
+    missing = {}
+    for k, pair in enumerate(zip(left, right)):
+        value = pairs.get(pair)
+        if value is None:
+            missing.setdefault(pair, []).append(k)
+        else:
+            pairs.move_to_end(pair)
+            ratio[k] = value
+    # Every lookup of a pair which is not in the cache is a miss, also the repeated pairs computed once
+    misses = sum(len(rows) for rows in missing.values())
+    cache["hits"] += len(left) - misses
+    cache["misses"] += misses
+    byRight = {}
+    for a, b in missing:
+        byRight.setdefault(b, []).append(a)
+    matcher = SequenceMatcher(None)
+    for b, values in byRight.items():
+        matcher.set_seq2(b)
+        for a in values:
+            # Equal strings have the ratio 1 (below 200 characters, where SequenceMatcher starts to treat popular characters as junk)
+            if type(a) == str and a == b and len(a) < 200:
+                value = 1.0
+            else:
+                matcher.set_seq1(a)
+                value = matcher.ratio()
+            ratio[missing[(a, b)]] = value
+            pairs[(a, b)] = value
+    while len(pairs) > cache["maxSize"]:
+        pairs.popitem(last=False)
+    return ratio
+
+def cacheStatistics(cache=scoreCache):
+    '''
+    Function to get the hit-rate statistics of the score cache (lookups of value pairs)
+    '''
+    lookups = cache["hits"] + cache["misses"]
+    return {"hits": cache["hits"], "misses": cache["misses"], "hitRate": cache["hits"] / lookups if lookups else 0.0, "size": len(cache["pairs"])}
+
+# Weights (in percent) of the columns in the record based score
+weights = {"FIRST_NAME": 19, "LAST_NAME": 25, "DOB": 28, "STREET": 11,"ZIP": 6, "CITY": 8, "HNRNEW": 3}
+# Minimum number of matches scored at once by a worker of the process pool of MatchScore
+partitionRows = 20000
+# Customer, positive and negative list (pyarrow tables of the scored columns) in shared memory, attached by a worker of the process pool of MatchScore
+sharedTables = {}
+
+def scoringFrame(df):
+    '''
+    Function to bring preprocessed records held in memory by the matching scripts into the form in which the score scripts read them from the preprocessed files (scored columns, missing values as NaN, DOB as text)
+    '''
+    df = df[list(weights)].copy()
+    for col in df.columns.drop("DOB"):
+        df[col] = df[col].astype(object).where(~df[col].isin(defaultNaValues + ["0000-00-00"]), np.nan)
+    if pd.api.types.is_datetime64_any_dtype(df["DOB"]):
+        df["DOB"] = df["DOB"].dt.strftime("%Y-%m-%d")
+    else:
+        # Dates in a DOB column with text are written with their time
+        df["DOB"] = df["DOB"].map(lambda value: str(value) if isinstance(value, pd.Timestamp) else value)
+    return df
+
+def recordPositions(index, ids):
+    '''
+    Function to get the positions of the records (ids) in the index of a dataframe, raises a KeyError (same as .loc) for the IDs which are not in the index
+    '''
+    pos = index.get_indexer(ids)
+    if (pos < 0).any():
+        raise KeyError("IDs not in " + str(index.name) + ": " + ', '.join(map(str, pd.unique(np.asarray(ids)[pos < 0])[:10])))
+    return pos
+
+def scoreMatches(custIds, lstIds, df_cust, df_lst):
+    '''
+    Function to generate the overall match score of all the matched records (custIds[k], lstIds[k]) between customer list and positive/negative list at once.
+    The weights of the columns missing in either record are removed and the remaining weights are scaled to 100, a column scores its weight times the similarity of its values (DOB only if equal)
+    '''
+    cols = list(weights)
+    # Aligns the customer and list records of all the matches by position
+    cust = df_cust[cols].to_numpy(dtype=object)[recordPositions(df_cust.index, custIds)]
+    lst = df_lst[cols].to_numpy(dtype=object)[recordPositions(df_lst.index, lstIds)]
+    return recordScores(cust, lst)
+
+def recordScores(cust, lst):
+    '''
+    Function to generate the overall match score of the aligned customer and list records (arrays of the values of the columns of weights, one row per match)
+    '''
+    missing = pd.isna(cust) | pd.isna(lst)
+    W = np.array(list(weights.values()))
+    R = np.where(missing, W, 0).sum(axis=1)
+    W = np.where(missing, 0, W) * 100 / (100 - R)[:, None]
+    # Column scores are added in the order of the weights, same as the sum of a row
+    score = np.zeros(len(cust))
+    for k, col in enumerate(weights):
+        D = np.zeros(len(cust))
+        keep = np.flatnonzero(~missing[:, k])
+        if col == 'DOB':
+            D[keep] = cust[keep, k] == lst[keep, k]
+        else:
+            D[keep] = similarities(cust[keep, k], lst[keep, k])
+        score += D * W[:, k]
+    return score
+
+def shareTables(tables):
+    '''
+    Function to write the scored columns of dataframes (dict of names and dataframes) as Arrow IPC streams into shared memory blocks, returns the blocks
+    '''
+    blocks = {}
+    for name, df in tables.items():
+        table = pa.Table.from_pandas(df[list(weights)], preserve_index=False)
+        # The size of the stream is measured first, so that it is written directly into the block
+        sink = pa.MockOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        blocks[name] = shared_memory.SharedMemory(create=True, size=sink.size())
+        with pa.ipc.new_stream(pa.FixedSizeBufferWriter(pa.py_buffer(blocks[name].buf)), table.schema) as writer:
+            writer.write_table(table)
+    return blocks
+
+def initScoring(blocks):
+    '''
+    Function to initialize a worker of the process pool of MatchScore with the tables in shared memory (dict of the table names and names of the shared memory blocks), the tables are read without copy
+    '''
+    for name, blockName in blocks.items():
+        block = shared_memory.SharedMemory(name=blockName)
+        sharedTables[name] = (block, pa.ipc.open_stream(pa.py_buffer(block.buf)).read_all())
+
+def tableValues(table, pos):
+    '''
+    Function to get the values of the scored columns of the rows (positions pos) of a pyarrow table, None for the missing values
+    '''
+    rows = table.take(pa.array(pos))
+    return np.column_stack([rows.column(col).to_numpy(zero_copy_only=False).astype(object) for col in weights])
+
+def scorePartition(listName, custPos, lstPos):
+    '''
+    Function to score a partition of the matches with a list (positions of the customer and list records) in a worker of the process pool,
+    returns the scores and the hits and misses the partition added to the score cache of the worker
+    '''
+    hits, misses = scoreCache["hits"], scoreCache["misses"]
+    score = recordScores(tableValues(sharedTables["CUST"][1], custPos), tableValues(sharedTables[listName][1], lstPos))
+    return score, scoreCache["hits"] - hits, scoreCache["misses"] - misses
+
+def parallelScores(score, ids, matches, cust, workers):
+    '''
+    Function to score the matches with the lists (list name, flags of the matched rows, list IDs, list) in partitions of at least partitionRows rows in a process pool.
+    The customer list and the lists are put into shared memory once, only the positions of the records of a partition are sent to the workers
+    '''
+    blocks = shareTables(dict({"CUST": cust}, **{listName: lst for listName, rows, lstIds, lst in matches}))
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=initScoring, initargs=({name: block.name for name, block in blocks.items()},)) as executor:
+            partitions = []
+            for listName, rows, lstIds, lst in matches:
+                rows = np.flatnonzero(rows)
+                custPos = recordPositions(cust.index, ids[rows])
+                lstPos = recordPositions(lst.index, lstIds)
+                # Enough partitions for all the workers
+                size = max(partitionRows, -(-len(rows) // workers))
+                for start in range(0, len(rows), size):
+                    partitions.append((rows[start:start + size], executor.submit(scorePartition, listName, custPos[start:start + size], lstPos[start:start + size])))
+            for rows, future in partitions:
+                score[rows], hits, misses = future.result()
+                scoreCache["hits"] += hits
+                scoreCache["misses"] += misses
+    finally:
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+    return score
+
+def MatchScore(ddm, cust, pos, neg, workers=1):
+    '''
+    Function to identify the matched rows and generate the score of all the matches with the positive list and of all the matches with the negative list (0 if matched with both).
+    With workers > 1 (and pyarrow installed) more than partitionRows matches are scored in a process pool of workers processes, with the same result
+    '''
+    score = np.zeros(len(ddm))
+    isPos = ddm['ID_NEG'].isna().to_numpy()
+    isNeg = ~isPos & ddm['ID_POS'].isna().to_numpy()
+    ids = ddm['ID_CUST'].to_numpy()
+    matches = [("POS", isPos, ddm['ID_POS'].to_numpy()[isPos], pos), ("NEG", isNeg, ddm['ID_NEG'].to_numpy()[isNeg], neg)]
+    if workers > 1 and pa is not None and len(ddm) > partitionRows:
+        score = parallelScores(score, ids, matches, cust, workers)
+    else:
+        for listName, rows, lstIds, lst in matches:
+            score[rows] = scoreMatches(ids[rows], lstIds, cust, lst)
+    ddm['NEW_SCORE'] = score
+    return ddm